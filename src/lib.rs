@@ -17,6 +17,7 @@ mod mcp;
 pub use domain::*;
 pub use storage::{SqliteStorage, StorageError, HabitStorage};
 pub use analytics::{AnalyticsEngine, Insight, InsightsParams, InsightsResponse};
+pub use mcp::Transport;
 
 /// Errors that can occur during server operation
 #[derive(Error, Debug)]
@@ -32,6 +33,9 @@ pub enum ServerError {
     
     #[error("JSON serialization error: {0}")]
     Json(#[from] serde_json::Error),
+
+    #[error("MessagePack serialization error: {0}")]
+    MsgPack(#[from] rmp_serde::encode::Error),
 }
 
 /// Main habit tracker server that implements the MCP protocol
@@ -67,6 +71,12 @@ impl HabitTrackerServer {
     /// 
     /// This method will block until the server is shut down or an error occurs.
     pub async fn run(self) -> Result<(), ServerError> {
+        self.run_with_options(Transport::default(), false).await
+    }
+
+    /// Run the MCP server using the given wire format, optionally replacing
+    /// emoji in tool output with ASCII sentinels
+    pub async fn run_with_options(self, transport: Transport, ascii_only: bool) -> Result<(), ServerError> {
         tracing::info!("Starting MCP server...");
         
         // Test database connectivity
@@ -74,7 +84,8 @@ impl HabitTrackerServer {
         tracing::info!("Server started successfully, found {} existing habits", habits.len());
         
         // Create and run the MCP server
-        let mut mcp_server = mcp::McpServer::new(self);
+        let mut mcp_server = mcp::McpServer::with_transport(self, transport)
+            .with_ascii_only(ascii_only);
         mcp_server.run().await?;
         
         Ok(())
@@ -7,7 +7,7 @@ use clap::Parser;
 use std::path::PathBuf;
 use tracing::info;
 
-use habit_tracker_mcp::HabitTrackerServer;
+use habit_tracker_mcp::{HabitTrackerServer, Transport};
 
 /// Get the default database path with robust fallback strategy
 fn get_default_database_path() -> Result<PathBuf, Box<dyn std::error::Error>> {
@@ -75,6 +75,18 @@ struct Args {
     /// Enable verbose output (implies debug)
     #[arg(short, long)]
     verbose: bool,
+
+    /// Exchange length-prefixed MessagePack messages instead of JSON lines
+    #[arg(long)]
+    msgpack: bool,
+
+    /// Exchange length-prefixed JSON messages instead of JSON lines
+    #[arg(long, conflicts_with = "msgpack")]
+    framed: bool,
+
+    /// Replace emoji in tool output with ASCII sentinels such as [ok] and [streak]
+    #[arg(long)]
+    ascii_only: bool,
 }
 
 #[tokio::main]
@@ -119,8 +131,16 @@ async fn main() -> Result<(), Box<dyn std::error::Error>> {
     // Create and start the habit tracker server
     let server = HabitTrackerServer::new(db_path).await?;
     
+    let transport = if args.msgpack {
+        Transport::MsgPack
+    } else if args.framed {
+        Transport::Framed
+    } else {
+        Transport::JsonLines
+    };
+
     // Run the MCP server - this will handle JSON-RPC communication over stdin/stdout
-    server.run().await?;
+    server.run_with_options(transport, args.ascii_only).await?;
     
     info!("Habit Tracker MCP server shutdown complete");
     Ok(())
@@ -7,4 +7,4 @@ pub mod protocol;
 pub mod server;
 
 // Re-export main types
-pub use server::McpServer;
\ No newline at end of file
+pub use server::{McpServer, Transport};
\ No newline at end of file
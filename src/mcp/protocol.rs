@@ -20,6 +20,10 @@ pub struct JsonRpcRequest {
     #[allow(dead_code)]
     pub jsonrpc: String,
     /// Unique identifier for this request
+    ///
+    /// Notifications (such as `initialized`) have no id and get no response;
+    /// the id then defaults to null.
+    #[serde(default)]
     pub id: Value,
     /// The method/tool name to call (e.g., "tools/call")
     pub method: String,
@@ -45,6 +49,19 @@ pub struct JsonRpcResponse {
     pub error: Option<JsonRpcError>,
 }
 
+/// Outgoing JSON-RPC message
+///
+/// A single request gets a single response; a batch request (a JSON array of
+/// requests) gets an array of responses, written back in one message.
+#[derive(Debug, Serialize)]
+#[serde(untagged)]
+pub enum JsonRpcOutput {
+    /// Response to a single request
+    Single(JsonRpcResponse),
+    /// Responses to a batch request
+    Batch(Vec<JsonRpcResponse>),
+}
+
 /// JSON-RPC error information
 #[derive(Debug, Serialize)]
 pub struct JsonRpcError {
@@ -79,6 +96,10 @@ pub struct ToolCallResult {
     /// Whether this is an error result
     #[serde(default)]
     pub is_error: bool,
+    /// ID of the habit this call created, so clients don't have to parse it
+    /// out of the text content
+    #[serde(skip_serializing_if = "Option::is_none")]
+    pub habit_id: Option<String>,
 }
 
 /// Content returned by a tool
@@ -112,6 +133,9 @@ pub struct ServerCapabilities {
     /// Tools that this server provides
     #[serde(skip_serializing_if = "Option::is_none")]
     pub tools: Option<ToolsCapability>,
+    /// Set when tool output uses ASCII sentinels instead of emoji
+    #[serde(skip_serializing_if = "Option::is_none")]
+    pub ascii: Option<bool>,
 }
 
 /// Tools capability information
@@ -227,6 +251,7 @@ impl ToolCallResult {
                 text,
             }],
             is_error: false,
+            habit_id: None,
         }
     }
 
@@ -238,8 +263,74 @@ impl ToolCallResult {
                 text: format!("Error: {}", error_message),
             }],
             is_error: true,
+            habit_id: None,
+        }
+    }
+
+    /// Attach the ID of a newly created habit to this result
+    pub fn with_habit_id(mut self, habit_id: String) -> Self {
+        self.habit_id = Some(habit_id);
+        self
+    }
+
+    /// Replace emoji in the text content with ASCII sentinels
+    pub fn into_ascii(mut self) -> Self {
+        for content in &mut self.content {
+            content.text = ascii_text(&content.text);
+        }
+        self
+    }
+}
+
+/// ASCII stand-ins for the emoji used in tool output, for clients that
+/// only check for markers and would rather not receive multi-byte emoji
+const ASCII_SENTINELS: &[(&str, &str)] = &[
+    ("⚠️", "[warn]"),
+    ("⚠", "[warn]"),
+    ("✅", "[ok]"),
+    ("❌", "[error]"),
+    ("🔥", "[streak]"),
+    ("🎯", "[habit]"),
+    ("📊", "[stats]"),
+    ("📋", "[list]"),
+    ("📅", "[date]"),
+    ("📈", "[trend]"),
+    ("💡", "[tip]"),
+    ("🎉", "[celebrate]"),
+    ("⏸️", "[paused]"),
+    ("⏸", "[paused]"),
+    ("▶️", "[resumed]"),
+    ("▶", "[resumed]"),
+];
+
+/// Rewrite text for ASCII-only clients
+///
+/// Known emoji become their sentinel and any other emoji is dropped. Other
+/// characters (such as non-ASCII letters in habit names) are kept as they are.
+pub fn ascii_text(text: &str) -> String {
+    let mut out = String::with_capacity(text.len());
+    let mut rest = text;
+
+    'chars: while let Some(ch) = rest.chars().next() {
+        for (emoji, sentinel) in ASCII_SENTINELS {
+            if let Some(after) = rest.strip_prefix(emoji) {
+                out.push_str(sentinel);
+                rest = after;
+                continue 'chars;
+            }
+        }
+        if !is_emoji(ch) {
+            out.push(ch);
         }
+        rest = &rest[ch.len_utf8()..];
     }
+
+    out
+}
+
+/// Whether a character is an emoji (or the variation selector that follows one)
+fn is_emoji(ch: char) -> bool {
+    matches!(ch as u32, 0x1F300..=0x1FAFF | 0x2600..=0x27BF | 0xFE0F)
 }
 
 /// Helper function to map storage errors to appropriate JSON-RPC error codes
@@ -256,4 +347,47 @@ pub fn storage_error_to_json_rpc_code(error: &crate::storage::StorageError) -> i
         StorageError::Serialization(_) => error_codes::INTERNAL_ERROR,
         StorageError::Migration(_) => error_codes::STORAGE_ERROR,
     }
-}
\ No newline at end of file
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn test_ascii_text_replaces_emoji() {
+        assert_eq!(ascii_text("✅ Logged! 🔥 Streak: 3 days"), "[ok] Logged! [streak] Streak: 3 days");
+        assert_eq!(ascii_text("⚠️ Missed yesterday"), "[warn] Missed yesterday");
+        assert_eq!(ascii_text("🏃 Run"), " Run");
+    }
+
+    #[test]
+    fn test_ascii_text_keeps_other_text() {
+        assert_eq!(ascii_text("🎯 Café reading"), "[habit] Café reading");
+    }
+
+    #[test]
+    fn test_ascii_text_covers_tool_output() {
+        // Messages as the tools and insights report produce them
+        let outputs = [
+            "✅ Created habit 'Run'! Ready to start your streak!",
+            "🔥 Logged habit completion! Current streak: 3 days",
+            "📊 Status: 1 of 1 habits active. Total streaks: 3 days",
+            "🎯 Run (1234abcd)\n   Current streak: 3 days | Best: 3 days | Rate: 42.0%",
+            "📋 **Habit Summary** (1 habits)",
+            "🎯 **Run** (health)\n   📅 Frequency: Daily | 🔥 Streak: 3 days | 📊 Rate: 42.0% | ✅ Total: 3 ⏸️ (paused)",
+            "⏸️ Paused habit 'Run'",
+            "▶️ Reactivated habit 'Run'",
+            "✅ Updated habit 'Run'",
+            "📊 **Habit Insights Report** (MONTH)",
+            "🎉 Great streak! ⚠️ Missed days 💡 Try mornings 📈 Weekday pattern",
+            "Error: ❌ Habit not found",
+        ];
+
+        for output in outputs {
+            let ascii = ascii_text(output);
+            assert!(ascii.is_ascii(), "non-ASCII left in {:?}", ascii);
+        }
+        assert_eq!(ascii_text("⏸️ Paused habit 'Run'"), "[paused] Paused habit 'Run'");
+        assert_eq!(ascii_text("▶️ Reactivated habit 'Run'"), "[resumed] Reactivated habit 'Run'");
+    }
+}
@@ -7,19 +7,41 @@
 
 use std::collections::HashMap;
 use serde_json::{json, Value};
-use tokio::io::{AsyncBufReadExt, AsyncWriteExt, BufReader};
+use tokio::io::{AsyncBufReadExt, AsyncRead, AsyncReadExt, AsyncWrite, AsyncWriteExt, BufReader};
 use tracing::{debug, error, info};
 
 use crate::mcp::protocol::*;
 use crate::tools;
 use crate::{HabitTrackerServer, ServerError, InsightsParams};
 
+/// Wire format used for JSON-RPC messages on stdin/stdout
+#[derive(Debug, Clone, Copy, PartialEq, Eq, Default)]
+pub enum Transport {
+    /// One JSON message per line (the standard MCP stdio transport)
+    #[default]
+    JsonLines,
+    /// JSON messages, each prefixed with a 4-byte big-endian length
+    Framed,
+    /// MessagePack messages, each prefixed with a 4-byte big-endian length
+    MsgPack,
+}
+
+/// Largest length-prefixed message we accept (16 MiB)
+///
+/// Without a limit, a JSON-lines client talking to a framed server would
+/// have its first four bytes (`{"js`) read as a length of about 2 GB.
+const MAX_FRAME_LEN: usize = 16 * 1024 * 1024;
+
 /// MCP server that handles communication with Claude
 pub struct McpServer {
     /// The underlying habit tracker server
     habit_tracker: HabitTrackerServer,
     /// Whether the server has been initialized
     initialized: bool,
+    /// Wire format used on stdin/stdout
+    transport: Transport,
+    /// Whether tool output has its emoji replaced with ASCII sentinels
+    ascii_only: bool,
 }
 
 impl McpServer {
@@ -28,11 +50,38 @@ impl McpServer {
         Self {
             habit_tracker,
             initialized: false,
+            transport: Transport::default(),
+            ascii_only: false,
         }
     }
-    
+
+    /// Create a new MCP server that speaks the given wire format
+    pub fn with_transport(habit_tracker: HabitTrackerServer, transport: Transport) -> Self {
+        Self {
+            transport,
+            ..Self::new(habit_tracker)
+        }
+    }
+
+    /// Replace emoji in tool output with ASCII sentinels from the start
+    ///
+    /// Clients can also ask for this by sending `{"ascii": true}` in the
+    /// capabilities of their initialize request.
+    pub fn with_ascii_only(mut self, ascii_only: bool) -> Self {
+        self.ascii_only = ascii_only;
+        self
+    }
+
     /// Run the MCP server, handling JSON-RPC over stdin/stdout
     pub async fn run(&mut self) -> Result<(), ServerError> {
+        match self.transport {
+            Transport::JsonLines => self.run_json_lines().await,
+            Transport::Framed | Transport::MsgPack => self.run_length_prefixed().await,
+        }
+    }
+
+    /// Serve newline-delimited JSON messages
+    async fn run_json_lines(&mut self) -> Result<(), ServerError> {
         info!("Starting MCP server, waiting for JSON-RPC requests...");
         
         let stdin = tokio::io::stdin();
@@ -72,33 +121,216 @@ impl McpServer {
         
         Ok(())
     }
-    
+
+    /// Serve length-prefixed messages (JSON or MessagePack)
+    ///
+    /// Each message is a 4-byte big-endian length followed by that many bytes
+    /// of payload, so messages may contain newlines and are read with exact
+    /// reads instead of scanning for a line end. Requests and responses carry
+    /// the same JSON-RPC shapes as the line transport, batches included.
+    async fn run_length_prefixed(&mut self) -> Result<(), ServerError> {
+        info!("Starting MCP server, waiting for length-prefixed {:?} requests...", self.transport);
+
+        self.serve_length_prefixed(tokio::io::stdin(), tokio::io::stdout()).await
+    }
+
+    /// Answer length-prefixed messages from `reader` until it is closed
+    ///
+    /// A message longer than `MAX_FRAME_LEN` gets an error response and ends
+    /// the session, since the stream can no longer be trusted to be in sync.
+    async fn serve_length_prefixed<R, W>(&mut self, mut reader: R, mut writer: W) -> Result<(), ServerError>
+    where
+        R: AsyncRead + Unpin,
+        W: AsyncWrite + Unpin,
+    {
+        let mut header = [0u8; 4];
+        let mut payload = Vec::new();
+
+        loop {
+            // Read the length prefix, then exactly that many payload bytes
+            match reader.read_exact(&mut header).await {
+                Ok(_) => {}
+                Err(e) if e.kind() == std::io::ErrorKind::UnexpectedEof => {
+                    info!("MCP server shutting down (stdin closed)");
+                    break;
+                }
+                Err(e) => {
+                    error!("Failed to read from stdin: {}", e);
+                    break;
+                }
+            }
+
+            let len = u32::from_be_bytes(header) as usize;
+            if len > MAX_FRAME_LEN {
+                error!("Message of {} bytes exceeds the {} byte limit", len, MAX_FRAME_LEN);
+                let response = JsonRpcOutput::Single(JsonRpcResponse::error(
+                    json!(null),
+                    error_codes::INVALID_REQUEST,
+                    format!("Message of {} bytes exceeds the {} byte limit", len, MAX_FRAME_LEN),
+                    None
+                ));
+                self.write_frame(&mut writer, &response).await?;
+                break;
+            }
+
+            payload.resize(len, 0);
+            if let Err(e) = reader.read_exact(&mut payload).await {
+                error!("Failed to read message body from stdin: {}", e);
+                break;
+            }
+
+            let response = match self.decode_payload(&payload) {
+                Ok(message) => self.process_message(message).await,
+                Err(e) => {
+                    error!("Failed to parse {:?} request: {}", self.transport, e);
+                    Some(JsonRpcOutput::Single(JsonRpcResponse::error(
+                        json!(null),
+                        error_codes::PARSE_ERROR,
+                        format!("Invalid {:?} message: {}", self.transport, e),
+                        None
+                    )))
+                }
+            };
+
+            // Notifications get no response
+            let Some(response) = response else {
+                continue;
+            };
+
+            self.write_frame(&mut writer, &response).await?;
+        }
+
+        Ok(())
+    }
+
+    /// Write one response as a length-prefixed message
+    async fn write_frame<W>(&self, writer: &mut W, output: &JsonRpcOutput) -> Result<(), ServerError>
+    where
+        W: AsyncWrite + Unpin,
+    {
+        let response_bytes = self.encode_payload(output)?;
+        writer.write_all(&(response_bytes.len() as u32).to_be_bytes()).await?;
+        writer.write_all(&response_bytes).await?;
+        writer.flush().await?;
+
+        debug!("Sent {} byte {:?} response", response_bytes.len(), self.transport);
+        Ok(())
+    }
+
+    /// Decode the payload of a length-prefixed message
+    fn decode_payload(&self, payload: &[u8]) -> Result<Value, String> {
+        match self.transport {
+            Transport::MsgPack => rmp_serde::from_slice(payload).map_err(|e| e.to_string()),
+            _ => serde_json::from_slice(payload).map_err(|e| e.to_string()),
+        }
+    }
+
+    /// Encode a response as the payload of a length-prefixed message
+    fn encode_payload(&self, output: &JsonRpcOutput) -> Result<Vec<u8>, ServerError> {
+        match self.transport {
+            // Structs are encoded as maps so clients see the same keys as in JSON
+            Transport::MsgPack => Ok(rmp_serde::to_vec_named(output)?),
+            _ => Ok(serde_json::to_vec(output)?),
+        }
+    }
+
     /// Process a single line of JSON-RPC input
-    async fn process_line(&mut self, line: &str) -> Option<JsonRpcResponse> {
+    ///
+    /// The line holds either one request object or a batch (a JSON array of
+    /// request objects), in which case all responses go back in one array.
+    async fn process_line(&mut self, line: &str) -> Option<JsonRpcOutput> {
         let line = line.trim();
         if line.is_empty() {
             return None;
         }
-        
+
         debug!("Processing request: {}", line);
-        
-        // Parse JSON-RPC request
-        let request: JsonRpcRequest = match serde_json::from_str(line) {
-            Ok(req) => req,
+
+        // Parse the raw JSON first so we can tell single requests from batches
+        let message: Value = match serde_json::from_str(line) {
+            Ok(value) => value,
             Err(e) => {
                 error!("Failed to parse JSON-RPC request: {}", e);
-                return Some(JsonRpcResponse::error(
+                return Some(JsonRpcOutput::Single(JsonRpcResponse::error(
                     json!(null),
                     error_codes::PARSE_ERROR,
                     format!("Invalid JSON: {}", e),
                     None
-                ));
+                )));
             }
         };
-        
-        Some(self.handle_request(request).await)
+
+        self.process_message(message).await
     }
-    
+
+    /// Process a decoded JSON-RPC message: a single request or a batch
+    ///
+    /// Returns None when there is nothing to send back, i.e. the message was
+    /// a notification or a batch made up only of notifications.
+    async fn process_message(&mut self, message: Value) -> Option<JsonRpcOutput> {
+        match message {
+            Value::Array(batch) => self.handle_batch(batch).await,
+            single => self.handle_message(single).await.map(JsonRpcOutput::Single),
+        }
+    }
+
+    /// Handle a JSON-RPC batch, answering every request in order
+    async fn handle_batch(&mut self, batch: Vec<Value>) -> Option<JsonRpcOutput> {
+        // An empty batch is itself an invalid request (JSON-RPC 2.0, section 6)
+        if batch.is_empty() {
+            return Some(JsonRpcOutput::Single(JsonRpcResponse::error(
+                json!(null),
+                error_codes::INVALID_REQUEST,
+                "Empty batch".to_string(),
+                None
+            )));
+        }
+
+        debug!("Processing batch of {} requests", batch.len());
+
+        let mut responses = Vec::with_capacity(batch.len());
+        for message in batch {
+            if let Some(response) = self.handle_message(message).await {
+                responses.push(response);
+            }
+        }
+
+        if responses.is_empty() {
+            None
+        } else {
+            Some(JsonRpcOutput::Batch(responses))
+        }
+    }
+
+    /// Validate one request object and dispatch it
+    ///
+    /// A request without an id is a notification: it is handled like any
+    /// other request, but no response is returned for it.
+    async fn handle_message(&mut self, message: Value) -> Option<JsonRpcResponse> {
+        let id = message.get("id").cloned();
+
+        match serde_json::from_value::<JsonRpcRequest>(message) {
+            Ok(request) => {
+                let method = request.method.clone();
+                let response = self.handle_request(request).await;
+                if id.is_none() {
+                    debug!("Handled notification: {}", method);
+                    return None;
+                }
+                Some(response)
+            }
+            Err(e) => {
+                error!("Invalid JSON-RPC request: {}", e);
+                Some(JsonRpcResponse::error(
+                    id.unwrap_or(json!(null)),
+                    error_codes::INVALID_REQUEST,
+                    format!("Invalid request: {}", e),
+                    None
+                ))
+            }
+        }
+    }
+
     /// Handle a JSON-RPC request
     async fn handle_request(&mut self, request: JsonRpcRequest) -> JsonRpcResponse {
         match request.method.as_str() {
@@ -123,6 +355,14 @@ impl McpServer {
     /// Handle MCP initialization request
     async fn handle_initialize(&mut self, request: JsonRpcRequest) -> JsonRpcResponse {
         info!("MCP client connected");
+
+        let wants_ascii = request.params.as_ref()
+            .and_then(|params| params.pointer("/capabilities/ascii"))
+            .and_then(|v| v.as_bool())
+            .unwrap_or(false);
+        if wants_ascii {
+            self.ascii_only = true;
+        }
         
         let result = InitializeResult {
             protocol_version: MCP_VERSION.to_string(),
@@ -130,6 +370,7 @@ impl McpServer {
                 tools: Some(ToolsCapability {
                     list_changed: false,
                 }),
+                ascii: self.ascii_only.then_some(true),
             },
             server_info: ServerInfo {
                 name: "Habit Tracker MCP".to_string(),
@@ -263,6 +504,7 @@ impl McpServer {
             "habit_update" => self.call_habit_update(tool_params.arguments).await,
             _ => ToolCallResult::error(format!("Unknown tool: {}", tool_params.name)),
         };
+        let result = if self.ascii_only { result.into_ascii() } else { result };
         
         JsonRpcResponse::success(request.id, serde_json::to_value(result).unwrap())
     }
@@ -288,13 +530,12 @@ impl McpServer {
         };
         
         match tools::create_habit(self.habit_tracker.storage(), create_params) {
-            Ok(response) => {
-                let message = if let Some(habit_id) = &response.habit_id {
-                    format!("{}\nHabit ID: {}", response.message, habit_id)
-                } else {
-                    response.message
-                };
-                ToolCallResult::success(message)
+            Ok(response) => match response.habit_id {
+                Some(habit_id) => {
+                    let message = format!("{}\nHabit ID: {}", response.message, habit_id);
+                    ToolCallResult::success(message).with_habit_id(habit_id)
+                }
+                None => ToolCallResult::success(response.message),
             },
             Err(e) => ToolCallResult::error(e.to_string()),
         }
@@ -440,4 +681,249 @@ impl McpServer {
             Err(e) => ToolCallResult::error(e.to_string()),
         }
     }
-}
\ No newline at end of file
+}
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use tempfile::{tempdir, TempDir};
+
+    /// Create an MCP server backed by a fresh database in a temporary directory
+    async fn test_server(transport: Transport) -> (McpServer, TempDir) {
+        let temp_dir = tempdir().unwrap();
+        let habit_tracker = HabitTrackerServer::new(temp_dir.path().join("test.db")).await.unwrap();
+        (McpServer::with_transport(habit_tracker, transport), temp_dir)
+    }
+
+    /// Split length-prefixed output into its payloads
+    fn split_frames(mut output: &[u8]) -> Vec<&[u8]> {
+        let mut frames = Vec::new();
+        while !output.is_empty() {
+            let len = u32::from_be_bytes(output[..4].try_into().unwrap()) as usize;
+            frames.push(&output[4..4 + len]);
+            output = &output[4 + len..];
+        }
+        frames
+    }
+
+    /// Split length-prefixed output into its JSON payloads
+    fn decode_frames(output: &[u8]) -> Vec<Value> {
+        split_frames(output).into_iter()
+            .map(|frame| serde_json::from_slice(frame).unwrap())
+            .collect()
+    }
+
+    /// Process one incoming message and return what would be sent back, as JSON
+    async fn reply(server: &mut McpServer, message: Value) -> Option<Value> {
+        server.process_message(message).await
+            .map(|output| serde_json::to_value(output).unwrap())
+    }
+
+    #[tokio::test]
+    async fn test_empty_batch_is_invalid() {
+        let (mut server, _temp_dir) = test_server(Transport::JsonLines).await;
+
+        let response = reply(&mut server, json!([])).await.unwrap();
+        assert!(response.is_object());
+        assert_eq!(response["error"]["code"], error_codes::INVALID_REQUEST);
+    }
+
+    #[tokio::test]
+    async fn test_batch_mixes_valid_and_invalid_requests() {
+        let (mut server, _temp_dir) = test_server(Transport::JsonLines).await;
+
+        let responses = reply(&mut server, json!([
+            {"jsonrpc": "2.0", "id": 1, "method": "tools/list"},
+            42,
+            {"jsonrpc": "2.0", "id": 3},
+            {"jsonrpc": "2.0", "id": 4, "method": "no/such/method"}
+        ])).await.unwrap();
+
+        let responses = responses.as_array().unwrap();
+        assert_eq!(responses.len(), 4);
+        assert!(responses[0]["result"]["tools"].is_array());
+        assert_eq!(responses[1]["id"], Value::Null);
+        assert_eq!(responses[1]["error"]["code"], error_codes::INVALID_REQUEST);
+        assert_eq!(responses[2]["id"], 3);
+        assert_eq!(responses[2]["error"]["code"], error_codes::INVALID_REQUEST);
+        assert_eq!(responses[3]["error"]["code"], error_codes::METHOD_NOT_FOUND);
+    }
+
+    #[tokio::test]
+    async fn test_batch_responses_keep_request_order() {
+        let (mut server, _temp_dir) = test_server(Transport::JsonLines).await;
+
+        let responses = reply(&mut server, json!([
+            {"jsonrpc": "2.0", "id": 3, "method": "tools/list"},
+            {"jsonrpc": "2.0", "id": "b", "method": "tools/list"},
+            {"jsonrpc": "2.0", "id": 1, "method": "tools/list"}
+        ])).await.unwrap();
+
+        let ids: Vec<Value> = responses.as_array().unwrap()
+            .iter()
+            .map(|response| response["id"].clone())
+            .collect();
+        assert_eq!(ids, vec![json!(3), json!("b"), json!(1)]);
+    }
+
+    #[tokio::test]
+    async fn test_notification_gets_no_response() {
+        let (mut server, _temp_dir) = test_server(Transport::JsonLines).await;
+
+        let response = reply(&mut server, json!({"jsonrpc": "2.0", "method": "initialized"})).await;
+        assert!(response.is_none());
+    }
+
+    #[tokio::test]
+    async fn test_null_id_is_still_answered() {
+        let (mut server, _temp_dir) = test_server(Transport::JsonLines).await;
+
+        let response = reply(&mut server, json!({"jsonrpc": "2.0", "id": null, "method": "tools/list"})).await.unwrap();
+        assert_eq!(response["id"], Value::Null);
+        assert!(response["result"]["tools"].is_array());
+    }
+
+    #[tokio::test]
+    async fn test_batch_of_notifications_gets_no_response() {
+        let (mut server, _temp_dir) = test_server(Transport::JsonLines).await;
+
+        let response = reply(&mut server, json!([
+            {"jsonrpc": "2.0", "method": "initialized"},
+            {"jsonrpc": "2.0", "method": "tools/list"}
+        ])).await;
+        assert!(response.is_none());
+    }
+
+    #[tokio::test]
+    async fn test_habit_create_returns_habit_id() {
+        let (mut server, _temp_dir) = test_server(Transport::JsonLines).await;
+
+        let response = reply(&mut server, json!({
+            "jsonrpc": "2.0",
+            "id": 1,
+            "method": "tools/call",
+            "params": {
+                "name": "habit_create",
+                "arguments": {"name": "Morning Run", "category": "health", "frequency": "daily"}
+            }
+        })).await.unwrap();
+
+        let result = &response["result"];
+        assert_eq!(result["is_error"], false);
+        let habit_id = result["habit_id"].as_str().unwrap();
+        let text = result["content"][0]["text"].as_str().unwrap();
+        assert!(text.contains(&format!("Habit ID: {}", habit_id)), "{}", text);
+    }
+
+    #[tokio::test]
+    async fn test_ascii_capability_switches_tool_output() {
+        let (mut server, _temp_dir) = test_server(Transport::JsonLines).await;
+
+        let init = reply(&mut server, json!({
+            "jsonrpc": "2.0",
+            "id": 1,
+            "method": "initialize",
+            "params": {
+                "protocol_version": MCP_VERSION,
+                "capabilities": {"ascii": true},
+                "client_info": {"name": "test", "version": "1.0.0"}
+            }
+        })).await.unwrap();
+        assert_eq!(init["result"]["capabilities"]["ascii"], true);
+
+        let response = reply(&mut server, json!({
+            "jsonrpc": "2.0",
+            "id": 2,
+            "method": "tools/call",
+            "params": {
+                "name": "habit_create",
+                "arguments": {"name": "Morning Run", "category": "health", "frequency": "daily"}
+            }
+        })).await.unwrap();
+        let text = response["result"]["content"][0]["text"].as_str().unwrap();
+        assert!(text.is_ascii(), "{}", text);
+        assert!(text.starts_with("[ok]"), "{}", text);
+    }
+
+    #[tokio::test]
+    async fn test_initialize_without_ascii_capability() {
+        let (mut server, _temp_dir) = test_server(Transport::JsonLines).await;
+
+        let init = reply(&mut server, json!({
+            "jsonrpc": "2.0",
+            "id": 1,
+            "method": "initialize",
+            "params": {
+                "protocol_version": MCP_VERSION,
+                "capabilities": {},
+                "client_info": {"name": "test", "version": "1.0.0"}
+            }
+        })).await.unwrap();
+        assert!(init["result"]["capabilities"].get("ascii").is_none());
+    }
+
+    #[tokio::test]
+    async fn test_framed_round_trip() {
+        let (mut server, _temp_dir) = test_server(Transport::Framed).await;
+
+        // A request, a notification (no response) and a batch, each length-prefixed
+        let mut input = Vec::new();
+        for message in [
+            json!({"jsonrpc": "2.0", "id": 1, "method": "tools/list"}),
+            json!({"jsonrpc": "2.0", "method": "initialized"}),
+            json!([{"jsonrpc": "2.0", "id": 2, "method": "tools/list"}]),
+        ] {
+            let payload = serde_json::to_vec(&message).unwrap();
+            input.extend_from_slice(&(payload.len() as u32).to_be_bytes());
+            input.extend_from_slice(&payload);
+        }
+        let mut output = Vec::new();
+        server.serve_length_prefixed(&input[..], &mut output).await.unwrap();
+
+        let frames = decode_frames(&output);
+        assert_eq!(frames.len(), 2);
+        assert_eq!(frames[0]["id"], 1);
+        assert!(frames[0]["result"]["tools"].is_array());
+        assert_eq!(frames[1][0]["id"], 2);
+    }
+
+    #[tokio::test]
+    async fn test_msgpack_round_trip() {
+        let (mut server, _temp_dir) = test_server(Transport::MsgPack).await;
+
+        let mut input = Vec::new();
+        for message in [
+            json!({"jsonrpc": "2.0", "id": 1, "method": "tools/list"}),
+            json!([{"jsonrpc": "2.0", "id": 2, "method": "tools/list"}]),
+        ] {
+            let payload = rmp_serde::to_vec_named(&message).unwrap();
+            input.extend_from_slice(&(payload.len() as u32).to_be_bytes());
+            input.extend_from_slice(&payload);
+        }
+        let mut output = Vec::new();
+        server.serve_length_prefixed(&input[..], &mut output).await.unwrap();
+
+        let frames: Vec<Value> = split_frames(&output).into_iter()
+            .map(|frame| rmp_serde::from_slice(frame).unwrap())
+            .collect();
+        assert_eq!(frames.len(), 2);
+        // Responses are maps with named keys, not positional arrays
+        assert_eq!(frames[0]["jsonrpc"], "2.0");
+        assert_eq!(frames[0]["id"], 1);
+        assert!(frames[0]["result"]["tools"].is_array());
+        assert_eq!(frames[1][0]["id"], 2);
+    }
+
+    #[tokio::test]
+    async fn test_oversized_frame_is_rejected() {
+        let (mut server, _temp_dir) = test_server(Transport::Framed).await;
+
+        // A JSON-lines request: its first four bytes read as a ~2 GB length
+        let input = b"{\"jsonrpc\":\"2.0\",\"id\":1,\"method\":\"tools/list\"}\n";
+        let mut output = Vec::new();
+        server.serve_length_prefixed(&input[..], &mut output).await.unwrap();
+
+        let frames = decode_frames(&output);
+        assert_eq!(frames.len(), 1);
+        assert_eq!(frames[0]["error"]["code"], error_codes::INVALID_REQUEST);
+    }
+}
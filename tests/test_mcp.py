@@ -4,15 +4,413 @@ Test script to simulate MCP client requests (like what Claude would send)
 
 This script sends JSON-RPC messages to our habit tracker MCP server
 to test if the protocol implementation works correctly.
+
+The server is run from the release binary, which is (re)built with
+
+    cargo build --release --bin habit-tracker-mcp
+
+at the start of the run; if the build fails, the run stops there. Set
+HABIT_MCP_BIN to the path of a prebuilt server binary to skip the build
+and run that instead.
+
+Pass --msgpack to talk to the server over length-prefixed MessagePack
+instead of JSON lines (requires the `msgpack` package), --framed for
+length-prefixed JSON, and --pipeline to send independent requests back to
+back instead of as JSON-RPC batches. --ascii-only asks the server for ASCII
+sentinels such as [ok] and [habit] in place of emoji.
+Set HABIT_MCP_DEBUG=1 to start the server with debug logging.
+Every JSON-RPC message is echoed when running on a terminal; set
+MCP_TEST_VERBOSE=1 to echo them when output is redirected too.
+
+On Windows, where select() does not work on pipes, reads from the server
+block instead of timing out, so a server that hangs at startup hangs the
+run rather than failing after the startup timeout.
+
+Other scripts can import MCPClient (or AsyncMCPClient, its asyncio
+counterpart) to drive a server the same way.
 """
 
+import argparse
+import asyncio
+import contextlib
 import json
+import os
+import re
+import select
+import selectors
+import struct
 import subprocess
 import sys
+import tempfile
+import threading
 import time
+from collections import deque
+from datetime import date
+from pathlib import Path
+
+try:
+    import msgpack
+except ImportError:  # Only needed for --msgpack runs
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:  # Fall back to the standard library json module
+    orjson = None
+
+# Wire format and dispatch mode for this run, set from the command line in main()
+USE_MSGPACK = False
+USE_FRAMED = False
+USE_PIPELINE = False
+USE_ASCII = False
+
+# Log every message sent and received: on a terminal, or with MCP_TEST_VERBOSE set
+VERBOSE = bool(os.environ.get("MCP_TEST_VERBOSE")) or sys.stdout.isatty()
+
+# Release server binary built by build_server() (see module docstring)
+REPO_ROOT = Path(__file__).resolve().parent.parent
+SERVER_BIN = REPO_ROOT / "target" / "release" / (
+    "habit-tracker-mcp.exe" if os.name == "nt" else "habit-tracker-mcp"
+)
+
+# Buffer size for the server's pipes; large enough for a multi-habit insights report
+PIPE_BUFFER_SIZE = 65536
+# Longest single message the asyncio client will read; the server caps
+# length-prefixed messages at the same size
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+
+# How long to wait for the server to answer its first request
+STARTUP_TIMEOUT = 10.0
+# Successive waits between checks that the server is still alive while it
+# starts; the last one repeats. A fast server answers during the first wait.
+STARTUP_POLL_INTERVALS = (0.01, 0.02, 0.05, 0.1, 0.2, 0.5)
+# select() only accepts sockets on Windows; there, reads from the server's
+# pipe simply block, and the startup timeout does not apply
+SELECT_ON_PIPES = os.name != "nt"
+
+# Markers looked for in tool output; each pattern finds all of its markers in one scan
+FREQUENCY_RE = re.compile(r"Daily|3 times per week|Weekdays|Weekends|Every 2 days")
+STREAK_DATA_RE = re.compile(r"streak|completion|rate|%", re.IGNORECASE)
+STRUCTURE_RE = re.compile(r"habit|frequency|active|category", re.IGNORECASE)
+# Emoji markers and the ASCII sentinels --ascii-only swaps in for them,
+# so the same checks pass in either mode
+HABIT_MARKERS = ("🎯", "[habit]")
+TIP_MARKERS = ("💡", "[tip]")
+INSIGHT_MARKERS = ("📊", "💡", "🎉", "[stats]", "[tip]", "[celebrate]")
+INSIGHT_EMOJI_RE = re.compile("|".join(map(re.escape, INSIGHT_MARKERS)))
+NONZERO_DIGIT_RE = re.compile(r"[1-9]")
+# Case-insensitive phrase checks, scanned in place rather than on a lowered copy
+HABITS_RE = re.compile(r"habits", re.IGNORECASE)
+HEALTH_RE = re.compile(r"health", re.IGNORECASE)
+INSIGHT_SUMMARY_RE = re.compile(r"insights:", re.IGNORECASE)
+COMPLETION_RATE_RE = re.compile(r"completion rate", re.IGNORECASE)
+STREAK_RE = re.compile(r"streak", re.IGNORECASE)
+PERFORMANCE_RE = re.compile(r"consistency|performance", re.IGNORECASE)
+RECOMMENDATION_RE = re.compile(
+    "|".join(["recommendation", *map(re.escape, TIP_MARKERS)]), re.IGNORECASE
+)
+DIVERSITY_RE = re.compile(r"diversifying|well-rounded", re.IGNORECASE)
+CATEGORY_ANALYSIS_RE = re.compile(r"life areas|categories", re.IGNORECASE)
+# Habit IDs are UUIDs, so match exactly that shape after the label
+HABIT_ID_RE = re.compile(r"Habit ID:\s*([0-9a-fA-F]{8}(?:-[0-9a-fA-F]{4}){3}-[0-9a-fA-F]{12})")
+# One habit_status entry: "🎯 Name (id...)" followed by its streak line
+STATUS_STREAK_RE = re.compile(
+    "(?:" + "|".join(map(re.escape, HABIT_MARKERS)) + ")"
+    r" (.+?) \([^)\n]*\)\n\s*Current streak: (\d+) days \| Best: (\d+) days"
+)
+
+# Fixture data for the test sections, built once at import
+# Extra habits created by 4.1, one per non-daily frequency
+TEST_HABITS = (
+    {"name": "Weekly Exercise", "category": "health", "frequency": "weekly:3"},
+    {"name": "Weekday Reading", "category": "productivity", "frequency": "weekdays"},
+    {"name": "Weekend Meditation", "category": "mindfulness", "frequency": "weekends"},
+    {"name": "Writing Practice", "category": "creative", "frequency": "interval:2"},
+)
+# habit_list sort orders checked by 4.1.2
+SORT_TESTS = (
+    ("streak", "streak sorting"),
+    ("completion_rate", "completion rate sorting"),
+    ("name", "name sorting"),
+)
+# Frequency labels expected in the 4.1.1 listing
+FREQUENCY_CHECKS = (
+    ("Daily", "daily frequency"),
+    ("3 times per week", "weekly frequency"),
+    ("Weekdays", "weekdays frequency"),
+    ("Weekends", "weekends frequency"),
+    ("Every 2 days", "interval frequency"),
+)
+# Streak markers expected in the 4.1.4 listing
+STREAK_INDICATORS = (
+    ("streak", "streak data"),
+    ("completion", "completion data"),
+    ("rate", "rate data"),
+    ("%", "percentage data"),
+)
+# Structure markers expected in the 4.1.5 listing
+STRUCTURE_CHECKS = (
+    ("habit", "habit references"),
+    ("frequency", "frequency data"),
+    ("active", "activity status"),
+    ("category", "category data"),
+)
+# One habit per frequency type for the section 9 streak checks
+STREAK_TEST_CASES = (
+    {"name": "Daily Streak Test", "frequency": "daily"},
+    {"name": "Weekdays Streak Test", "frequency": "weekdays"},
+    {"name": "Weekly Streak Test", "frequency": "weekly:3"},
+    {"name": "Weekend Streak Test", "frequency": "weekends"},
+    {"name": "Interval Streak Test", "frequency": "interval:3"},
+)
+
+# Params that never change, built once and shared by every request that sends them
+INITIALIZE_PARAMS = {
+    "protocol_version": "2024-11-05",
+    "capabilities": {},
+    "client_info": {
+        "name": "Test Client",
+        "version": "1.0.0"
+    }
+}
+ASCII_INITIALIZE_PARAMS = {**INITIALIZE_PARAMS, "capabilities": {"ascii": True}}
+MONTH_INSIGHTS = {"time_period": "month", "insight_type": "all"}
+
+def json_dumps(obj):
+    """Serialize to compact UTF-8 JSON bytes, using orjson when available"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    # Compact separators: no padding spaces on the wire
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+def json_loads(data):
+    """Parse JSON from bytes, using orjson when available"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(bytes(data))
+
+def write_message(stream, message):
+    """Encode a message in the active wire format, log it and write it to stream
+
+    The message is serialized once; the log line reuses the encoded JSON.
+    The caller flushes.
+    """
+    if USE_MSGPACK:
+        payload = msgpack.packb(message, use_bin_type=True)
+    else:
+        payload = json_dumps(message)
+    if VERBOSE:
+        print(f"→ Sending: {message_text(payload, message)}")
+    if USE_MSGPACK or USE_FRAMED:
+        stream.write(struct.pack(">I", len(payload)))
+        stream.write(payload)
+    else:
+        stream.write(payload)
+        stream.write(b"\n")
+
+class StdoutFramer:
+    """Split the server's stdout into messages
+
+    The pipe is read in bulk with read1() into one receive buffer, and whole
+    messages (lines, or length-prefixed frames) are cut out of that buffer,
+    so a burst of responses costs one read call rather than one per message.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._recv_buf = bytearray()
+
+    def _message_end(self):
+        """Offset just past the first complete buffered message, or None"""
+        buf = self._recv_buf
+        if USE_MSGPACK or USE_FRAMED:
+            if len(buf) < 4:
+                return None
+            (length,) = struct.unpack_from(">I", buf)
+            return 4 + length if len(buf) >= 4 + length else None
+        newline = buf.find(b"\n")
+        return newline + 1 if newline >= 0 else None
+
+    def has_message(self):
+        """Whether a complete message is already buffered"""
+        return self._message_end() is not None
+
+    def read_message(self):
+        """Return the payload of the next message, or b"" once stdout is closed
+
+        The payload excludes the framing (length prefix or newline), so it
+        can go straight to the decoder.
+        """
+        end = self._message_end()
+        while end is None:
+            chunk = self.stream.read1(PIPE_BUFFER_SIZE)
+            if not chunk:
+                return b""
+            self._recv_buf += chunk
+            end = self._message_end()
+        start, stop = (4, end) if USE_MSGPACK or USE_FRAMED else (0, end - 1)
+        # Slice through a view so the payload is copied once; the view must
+        # be released before the buffer can be resized
+        with memoryview(self._recv_buf) as view:
+            payload = bytes(view[start:stop])
+        del self._recv_buf[:end]
+        return payload
+
+def drain_into(stream, chunks):
+    """Append everything read from stream to chunks, in bulk reads, until it ends"""
+    while chunk := stream.read1(PIPE_BUFFER_SIZE):
+        chunks.append(chunk)
+
+def decode_message(payload):
+    """Decode one message read by StdoutFramer.read_message"""
+    if USE_MSGPACK:
+        return msgpack.unpackb(payload, raw=False)
+    return json_loads(payload)
+
+def message_text(payload, message):
+    """Text to log for a message: its encoded JSON, without serializing it again
+
+    Only MessagePack payloads need re-serializing to be readable.
+    """
+    if USE_MSGPACK:
+        return json.dumps(message, ensure_ascii=False)
+    return str(payload, "utf-8")
+
+def wait_until_readable(process, framer, timeout, intervals=STARTUP_POLL_INTERVALS):
+    """Wait for the server's stdout to have data, the server to exit or time to run out
+
+    Each wait returns as soon as stdout is readable; between waits the
+    server is checked for having exited, backing off through `intervals`.
+    """
+    if framer.has_message():
+        return True
+    if not SELECT_ON_PIPES:
+        # Nothing to wait on; the blocking read that follows does the waiting
+        return process.poll() is None
+    deadline = time.monotonic() + timeout
+    attempt = 0
+    while (remaining := deadline - time.monotonic()) > 0:
+        if process.poll() is not None:
+            return False
+        interval = intervals[min(attempt, len(intervals) - 1)]
+        readable, _, _ = select.select([process.stdout], [], [], min(interval, remaining))
+        if readable:
+            return True
+        attempt += 1
+    return False
+
+def exchange(process, framer, message, timeout=None):
+    """Send one message (a request or a batch) and return the decoded reply, or None
+
+    With a timeout, give up if the server has not started answering within
+    that many seconds.
+    """
+    write_message(process.stdin, message)
+    process.stdin.flush()
+
+    if timeout is not None and not wait_until_readable(process, framer, timeout):
+        print(f"❌ No response from server within {timeout}s")
+        return None
+
+    # Read response
+    payload = framer.read_message()
+    if not payload:
+        return None
 
-def send_request(process, request_id, method, params=None):
-    """Send a JSON-RPC request to the MCP server"""
+    try:
+        reply = decode_message(payload)
+    except ValueError as e:
+        print(f"❌ Failed to parse response: {e}")
+        return None
+    if VERBOSE:
+        print(f"← Received: {message_text(payload, reply)}")
+    return reply
+
+def send_batch(process, framer, requests, timeout=None):
+    """Send several JSON-RPC requests as one batch and return responses keyed by id
+
+    The whole batch goes out as a single array message and the server answers
+    with a single array, so N calls cost one write/read round trip.
+    Responses may come back in any order, hence the dict keyed by request id.
+    """
+    responses = exchange(process, framer, requests, timeout)
+    if responses is None:
+        return {}
+
+    # A batch-level error (e.g. a parse error) comes back as a single object
+    if isinstance(responses, dict):
+        responses = [responses]
+    return {response.get("id"): response for response in responses}
+
+class Pipeliner:
+    """Keep several requests in flight and collect their responses by id
+
+    submit() writes a request and returns at once, so the caller can go on
+    checking earlier results while the server works; drain_until() then
+    reads responses (stashing any that arrive first) until the wanted one
+    shows up.
+    """
+
+    def __init__(self, process, framer):
+        self.process = process
+        self.framer = framer
+        self.outstanding = deque()
+        self.responses = {}
+        self.selector = None
+        if SELECT_ON_PIPES:
+            self.selector = selectors.DefaultSelector()
+            self.selector.register(process.stdout, selectors.EVENT_READ)
+
+    def close(self):
+        if self.selector is not None:
+            self.selector.close()
+
+    def submit(self, request):
+        """Send a request without waiting for its response"""
+        write_message(self.process.stdin, request)
+        self.process.stdin.flush()
+        self.outstanding.append(request["id"])
+
+    def _receive(self, timeout):
+        """Read one response into the stash; False if none arrived in time"""
+        # The selector only sees the pipe, not what the framer already holds;
+        # without one, the read below blocks until a response arrives
+        if (self.selector is not None and not self.framer.has_message()
+                and not self.selector.select(timeout)):
+            print(f"❌ No response from server within {timeout}s")
+            return False
+        payload = self.framer.read_message()
+        if not payload:
+            self.outstanding.clear()
+            return False
+        try:
+            response = decode_message(payload)
+        except ValueError as e:
+            print(f"❌ Failed to parse response: {e}")
+            return True
+        if VERBOSE:
+            print(f"← Received: {message_text(payload, response)}")
+        request_id = response.get("id")
+        if request_id in self.outstanding:
+            self.outstanding.remove(request_id)
+        self.responses[request_id] = response
+        return True
+
+    def drain_until(self, request_id, timeout=None):
+        """Read responses until the one for request_id arrives and return it (or None)"""
+        while request_id not in self.responses and request_id in self.outstanding:
+            if not self._receive(timeout):
+                break
+        return self.responses.pop(request_id, None)
+
+    def drain(self, timeout=None):
+        """Read every outstanding response, e.g. before a blocking call reuses the pipe"""
+        while self.outstanding:
+            if not self._receive(timeout):
+                break
+
+def make_request(request_id, method, params=None):
+    """Build a JSON-RPC request object"""
     request = {
         "jsonrpc": "2.0",
         "id": request_id,
@@ -20,757 +418,1064 @@ def send_request(process, request_id, method, params=None):
     }
     if params:
         request["params"] = params
-    
-    request_str = json.dumps(request)
-    print(f"→ Sending: {request_str}")
-    
-    process.stdin.write(request_str + "\n")
+    return request
+
+def send_request(process, framer, request_id, method, params=None, timeout=None):
+    """Send a JSON-RPC request to the MCP server and return its response (or None)
+
+    The request goes out as a plain object, not a one-element batch; MCP
+    does not allow initialize inside a batch.
+    """
+    response = exchange(process, framer, make_request(request_id, method, params), timeout)
+    return response if isinstance(response, dict) else None
+
+def write_notification(stream, method, params=None):
+    """Write a JSON-RPC notification: no id, and the server sends nothing back"""
+    write_message(stream, {"jsonrpc": "2.0", "method": method, "params": params or {}})
+
+def send_notification(process, method, params=None):
+    """Send a JSON-RPC notification and flush it"""
+    write_notification(process.stdin, method, params)
     process.stdin.flush()
-    
-    # Read response
-    response_str = process.stdout.readline()
-    if response_str:
-        print(f"← Received: {response_str.strip()}")
+
+def extract_habit_id(text):
+    """Find the habit ID in a habit_create message, or None"""
+    match = HABIT_ID_RE.search(text)
+    return match.group(1) if match else None
+
+def result_text(response):
+    """(is_error, text) for a tool call response, from one walk of the result
+
+    text is the first content item's text. is_error is None when there is
+    no result at all (no response, or a JSON-RPC level error).
+    """
+    result = response.get("result") if response else None
+    if not result:
+        return None, ""
+    content = result.get("content")
+    return bool(result.get("is_error")), content[0].get("text", "") if content else ""
+
+def response_text(response):
+    """Text of the first content item of a tool call response ("" if there is none)"""
+    return result_text(response)[1]
+
+def response_ok(response):
+    """Whether a tool call got a result that isn't an error"""
+    return result_text(response)[0] is False
+
+def response_is_error(response):
+    """Whether a tool call got a result flagged as an error"""
+    return result_text(response)[0] is True
+
+def created_habit_id(response, text=None):
+    """Habit ID from a habit_create response
+
+    Uses the structured habit_id field of the result and only falls back to
+    scanning the message text for servers that don't send it. Pass text if
+    the caller has already looked it up with result_text().
+    """
+    result = (response or {}).get("result") or {}
+    if result.get("habit_id"):
+        return result["habit_id"]
+    return extract_habit_id(response_text(response) if text is None else text)
+
+def parse_streaks(status_text):
+    """Map habit name -> (current streak, best streak) for habit_status output
+
+    One regex pass covers every habit.
+    """
+    return {
+        match.group(1): (int(match.group(2)), int(match.group(3)))
+        for match in STATUS_STREAK_RE.finditer(status_text)
+    }
+
+def extract_streak_data(status_text, habit_name):
+    """Find (current streak, best streak) for a habit in habit_status output"""
+    return parse_streaks(status_text).get(habit_name, (None, None))
+
+def recent_days(count):
+    """ISO dates and weekday numbers (Monday=0) for the last `count` days
+
+    Index j is the day j days ago. Dates come from day ordinals and weekdays
+    from today's weekday by modular arithmetic, so no datetime is built or
+    queried per day.
+    """
+    today = date.today()
+    ordinal = today.toordinal()
+    weekday = today.weekday()
+    dates = [date.fromordinal(ordinal - j).isoformat() for j in range(count)]
+    weekdays = [(weekday - j) % 7 for j in range(count)]
+    return dates, weekdays
+
+def streak_offsets(frequency, recent_weekdays):
+    """Which recent days (as days-ago offsets) to log for a streak test habit"""
+    if frequency == "daily":
+        # Log 3 consecutive days
+        return [2, 1, 0]
+    if frequency == "weekdays":
+        # Log weekdays only (Monday=0 to Friday=4)
+        return [j for j in range(7) if recent_weekdays[j] < 5]
+    if frequency == "weekends":
+        # Log weekends only (Saturday=5, Sunday=6)
+        return [j for j in range(14) if recent_weekdays[j] >= 5]
+    if "weekly:" in frequency:
+        # Log 3 times this week and 3 times last week
+        return [0, 2, 4, 7, 9, 11]
+    if "interval:" in frequency:
+        # Log every 3 days
+        return [0, 3, 6]
+    return []
+
+def tool_call(name, arguments=None):
+    """Build the (method, params) pair for a tools/call request"""
+    return "tools/call", {"name": name, "arguments": arguments or {}}
+
+def initialize_params():
+    """Params for the initialize request, asking for ASCII output with --ascii-only"""
+    return ASCII_INITIALIZE_PARAMS if USE_ASCII else INITIALIZE_PARAMS
+
+class MCPClient:
+    """A running habit tracker MCP server and a JSON-RPC client for it
+
+    Use as a context manager: the server is started on entry and shut down
+    on exit, so any number of test sections (or scripts importing this
+    module) can share one server process. Request ids are assigned
+    automatically.
+    """
+
+    def __init__(self, server_bin=SERVER_BIN, server_args=()):
+        self.server_bin = Path(server_bin)
+        self.server_args = list(server_args)
+        self.process = None
+        self.stderr = b""
+        self.framer = None
+        self.pipeliner = None
+        self.init_response = None
+        self.init_attempted = False
+        self._tools = None
+        self._stderr_chunks = []
+        self._stderr_thread = None
+        self._next_id = 1
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def start(self):
+        """Start the server process"""
+        # Pipes are binary: messages are encoded/decoded explicitly per wire
+        # format, with no text codec layer in between
+        self.process = subprocess.Popen(
+            [str(self.server_bin)] + self.server_args,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=PIPE_BUFFER_SIZE,
+            # Plain log lines: no ANSI colour codes on stderr
+            env={**os.environ, "NO_COLOR": "1"}
+        )
+        # Keep stderr drained for the whole run; if its pipe filled up, the
+        # server would block writing logs and stop answering requests
+        self._stderr_chunks = []
+        self._stderr_thread = threading.Thread(
+            target=drain_into, args=(self.process.stderr, self._stderr_chunks), daemon=True
+        )
+        self._stderr_thread.start()
+        self.framer = StdoutFramer(self.process.stdout)
+        self.pipeliner = Pipeliner(self.process, self.framer)
+        self.init_response = None
+        self.init_attempted = False
+        self._tools = None
+
+    def close(self):
+        """Stop the server and keep whatever it wrote to stderr"""
+        if self.process is None:
+            return
+        self.pipeliner.close()
+        self.pipeliner = None
+        self.process.terminate()
         try:
-            return json.loads(response_str.strip())
-        except json.JSONDecodeError as e:
-            print(f"❌ Failed to parse response: {e}")
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self._stderr_thread.join(timeout=1)
+        self.stderr = b"".join(self._stderr_chunks)
+        self.process = None
+        self.framer = None
+
+    def _take_ids(self, count):
+        first = self._next_id
+        self._next_id += count
+        return range(first, first + count)
+
+    def initialize(self, params, timeout=STARTUP_TIMEOUT):
+        """Send the initialize request, waiting at most `timeout` for the server to come up"""
+        (request_id,) = self._take_ids(1)
+        self.pipeliner.drain()
+        return send_request(self.process, self.framer, request_id, "initialize", params, timeout=timeout)
+
+    def open_session(self, params, timeout=STARTUP_TIMEOUT):
+        """Initialize the session and, if that worked, send the initialized notification
+
+        The initialize response is kept as init_response and returned; it is
+        None if the server did not answer, e.g. because it exited at startup.
+        """
+        self.init_attempted = True
+        try:
+            self.init_response = self.initialize(params, timeout)
+            if self.init_response and self.init_response.get("result"):
+                self.notify("initialized", {})
+        except OSError as e:
+            # The server went away before reading the request; what it wrote
+            # to stderr (e.g. an unknown argument) is kept for the caller
+            print(f"❌ Server closed the connection during startup: {e}")
+            self.init_response = None
+        return self.init_response
+
+    def call(self, method, params=None):
+        """Send one request and return its response (or None)"""
+        (request_id,) = self._take_ids(1)
+        self.pipeliner.drain()
+        return send_request(self.process, self.framer, request_id, method, params)
+
+    def notify(self, method, params=None):
+        """Send a notification; there is no response to wait for"""
+        send_notification(self.process, method, params)
+
+    def call_tool(self, name, arguments=None):
+        """Call one MCP tool and return the response (or None)"""
+        return self.call(*tool_call(name, arguments))
+
+    def list_tools(self):
+        """The server's tool definitions, fetched with tools/list once per server
+
+        Returns None if the server did not answer with a tool list.
+        """
+        if self._tools is None:
+            response = self.call("tools/list", {})
+            if response and response.get("result"):
+                self._tools = response["result"].get("tools", [])
+        return self._tools
+
+    def batch(self, calls):
+        """Send (method, params) pairs as one JSON-RPC batch; responses in call order"""
+        ids = self._take_ids(len(calls))
+        self.pipeliner.drain()
+        responses = send_batch(self.process, self.framer, [
+            make_request(request_id, method, params)
+            for request_id, (method, params) in zip(ids, calls)
+        ])
+        return [responses.get(request_id) for request_id in ids]
+
+    def submit(self, method, params=None):
+        """Send one request without waiting; returns the id to collect() it by"""
+        (request_id,) = self._take_ids(1)
+        self.pipeliner.submit(make_request(request_id, method, params))
+        return request_id
+
+    def submit_tool(self, name, arguments=None):
+        """Call one MCP tool without waiting; returns the id to collect() it by"""
+        return self.submit(*tool_call(name, arguments))
+
+    def collect(self, request_id):
+        """Wait for the response to a submitted request and return it (or None)"""
+        return self.pipeliner.drain_until(request_id)
+
+    def many(self, calls):
+        """Send independent (method, params) pairs, pipelined or batched; responses in call order"""
+        if not calls:
+            return []
+        if USE_PIPELINE:
+            ids = [self.submit(method, params) for method, params in calls]
+            return [self.collect(request_id) for request_id in ids]
+        return self.batch(calls)
+
+# Client of the outermost active mcp_session(), shared by any nested ones
+_shared_client = None
+
+@contextlib.contextmanager
+def mcp_session(server_bin=SERVER_BIN, server_args=()):
+    """Yield a client whose server has been started and initialized
+
+    The outermost session starts the server; sessions opened inside it reuse
+    that same client instead of starting another process, and must ask for
+    the same server_bin and server_args. The server stops when the outermost
+    session ends. The initialize response is available as
+    client.init_response; it is None if the server failed to start.
+    """
+    global _shared_client
+    if _shared_client is not None:
+        if (Path(server_bin), list(server_args)) != (_shared_client.server_bin, _shared_client.server_args):
+            raise ValueError("a nested mcp_session() must use the same server_bin and server_args as the outer one")
+        yield _shared_client
+        return
+
+    client = MCPClient(server_bin, server_args)
+    with client:
+        client.open_session(initialize_params())
+        _shared_client = client
+        try:
+            yield client
+        finally:
+            _shared_client = None
+
+class AsyncMCPClient:
+    """An asyncio JSON-RPC client for its own habit tracker MCP server
+
+    Requests are written without waiting; a reader task resolves each
+    request's future as its response arrives, in whatever order that is.
+    Independent calls can therefore be awaited together with
+    asyncio.gather(), overlapping their round trips.
+    """
+
+    def __init__(self, server_bin=SERVER_BIN, server_args=()):
+        self.server_bin = Path(server_bin)
+        self.server_args = list(server_args)
+        self.process = None
+        self.stderr = b""
+        self._pending = {}
+        self._next_id = 1
+        self._reader_task = None
+        self._stderr_task = None
+        self._stderr_chunks = []
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+        return False
+
+    async def start(self):
+        """Start the server process and the tasks that read its output"""
+        self.process = await asyncio.create_subprocess_exec(
+            str(self.server_bin), *self.server_args,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env={**os.environ, "NO_COLOR": "1"},
+            # readuntil() gives up on lines longer than this (64 KiB by default)
+            limit=MAX_MESSAGE_SIZE
+        )
+        self._stderr_chunks = []
+        self._reader_task = asyncio.create_task(self._read_responses())
+        self._stderr_task = asyncio.create_task(self._drain_stderr())
+
+    async def close(self):
+        """Stop the server and keep whatever it wrote to stderr"""
+        if self.process is None:
+            return
+        if self.process.returncode is None:
+            self.process.terminate()
+        try:
+            await asyncio.wait_for(self.process.wait(), timeout=5)
+        except asyncio.TimeoutError:
+            self.process.kill()
+            await self.process.wait()
+        await self._reader_task
+        # Read past anything a stopped reader left behind, so the pipe sees
+        # end of file and its transport closes while the loop is running
+        await self.process.stdout.read()
+        await self._stderr_task
+        self.stderr = b"".join(self._stderr_chunks)
+        self.process = None
+
+    async def _read_message(self):
+        """Read the payload of one message, or b"" once stdout is closed"""
+        stdout = self.process.stdout
+        try:
+            if USE_MSGPACK or USE_FRAMED:
+                (length,) = struct.unpack(">I", await stdout.readexactly(4))
+                return await stdout.readexactly(length)
+            return (await stdout.readuntil(b"\n"))[:-1]
+        except asyncio.IncompleteReadError:
+            return b""
+
+    async def _read_responses(self):
+        """Resolve pending requests as their responses arrive"""
+        try:
+            while payload := await self._read_message():
+                try:
+                    message = decode_message(payload)
+                except ValueError as e:
+                    print(f"❌ Failed to parse response: {e}")
+                    continue
+                if VERBOSE:
+                    print(f"← Received: {message_text(payload, message)}")
+                future = self._pending.pop(message.get("id"), None)
+                if future is not None and not future.done():
+                    future.set_result(message)
+        except asyncio.LimitOverrunError as e:
+            print(f"❌ Response longer than {MAX_MESSAGE_SIZE} bytes: {e}")
+        finally:
+            # The server is gone (or can no longer be read): nothing else
+            # will be answered
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_result(None)
+            self._pending.clear()
+
+    async def _drain_stderr(self):
+        while chunk := await self.process.stderr.read(PIPE_BUFFER_SIZE):
+            self._stderr_chunks.append(chunk)
+
+    async def call(self, method, params=None):
+        """Send one request and wait for its response (or None)"""
+        # Once the reader has stopped nothing would resolve the future, even
+        # if the server is still running and accepts the write
+        if self._reader_task.done():
+            return None
+        request_id = self._next_id
+        self._next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        write_message(self.process.stdin, make_request(request_id, method, params))
+        await self.process.stdin.drain()
+        return await future
+
+    async def call_tool(self, name, arguments=None):
+        """Call one MCP tool and wait for the response (or None)"""
+        return await self.call(*tool_call(name, arguments))
+
+    async def notify(self, method, params=None):
+        """Send a notification; there is no response to wait for"""
+        write_notification(self.process.stdin, method, params)
+        await self.process.stdin.drain()
+
+    async def initialize(self, params, timeout=STARTUP_TIMEOUT):
+        """Initialize the session, waiting at most `timeout` for the server to come up"""
+        try:
+            response = await asyncio.wait_for(self.call("initialize", params), timeout)
+        except asyncio.TimeoutError:
+            print(f"❌ No response from server within {timeout}s")
             return None
-    return None
+        except OSError:
+            # The server exited at startup; the caller reports it along with
+            # the server's stderr
+            return None
+        if response and response.get("result"):
+            await self.notify("initialized", {})
+        return response
+
+class HabitTrackerMcpTests:
+    """The MCP protocol test sections, run in order against one shared server"""
+
+    def __init__(self, client):
+        self.client = client
+        # State handed from one section to the next
+        self.create_response = None
+        self.habit_id = None
+
+    def run_all(self):
+        # Output is block-buffered (see main()); flush once per section so
+        # progress still shows up section by section
+        if not self.test_initialization():
+            return
+        sys.stdout.flush()
+        for section in (
+            self.test_tool_discovery,
+            self.test_habit_creation,
+            self.test_habit_listing,
+            self.test_enhanced_listing,
+            self.test_habit_logging,
+            self.test_habit_status,
+            self.test_insights,
+            self.test_error_handling,
+            self.test_streak_calculations,
+        ):
+            section()
+            sys.stdout.flush()
 
-def main():
-    print("🧪 Testing Habit Tracker MCP Server")
-    print("=" * 50)
-    
-    # Start the MCP server process
-    print("Starting MCP server...")
-    process = subprocess.Popen(
-        ["cargo", "run", "--bin", "habit-tracker-mcp", "--", "--debug"],
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-        bufsize=1  # Line buffered
-    )
-    
-    try:
-        # Give the server a moment to start
-        time.sleep(2)
-        
+        print("\n🎉 MCP Server test completed!")
+
+    def test_initialization(self):
         print("\n1. Testing MCP Initialization")
         print("-" * 30)
-        
-        # Initialize the connection
-        init_response = send_request(process, 1, "initialize", {
-            "protocol_version": "2024-11-05",
-            "capabilities": {},
-            "client_info": {
-                "name": "Test Client",
-                "version": "1.0.0"
-            }
-        })
-        
+
+        # mcp_session() has normally initialized the connection already; the
+        # first answer also tells us the server is up. A failed attempt is not
+        # retried: that would wait out the startup timeout a second time
+        if self.client.init_attempted:
+            init_response = self.client.init_response
+        else:
+            init_response = self.client.open_session(initialize_params())
+
         if init_response and init_response.get("result"):
             print("✅ Initialization successful!")
-        else:
-            print("❌ Initialization failed")
-            return
-        
-        # Send initialized notification
-        send_request(process, 2, "initialized", {})
-        
+            return True
+        print("❌ Initialization failed")
+        return False
+
+    def test_tool_discovery(self):
         print("\n2. Testing Tool Discovery")
         print("-" * 30)
-        
+
         # List available tools
-        tools_response = send_request(process, 3, "tools/list", {})
-        
-        if tools_response and tools_response.get("result"):
-            tools = tools_response["result"].get("tools", [])
+        tools = self.client.list_tools()
+
+        if tools is not None:
             print(f"✅ Found {len(tools)} tools:")
             for tool in tools:
                 print(f"   - {tool['name']}: {tool['description']}")
         else:
             print("❌ Tool discovery failed")
-        
+
+    def test_habit_creation(self):
         print("\n3. Testing Habit Creation")
         print("-" * 30)
-        
+
         # Create a test habit
-        create_response = send_request(process, 4, "tools/call", {
-            "name": "habit_create",
-            "arguments": {
-                "name": "Morning Exercise",
-                "category": "health",
-                "frequency": "daily"
-            }
+        create_response = self.client.call_tool("habit_create", {
+            "name": "Morning Exercise",
+            "category": "health",
+            "frequency": "daily"
         })
-        
-        if create_response and create_response.get("result"):
+        self.create_response = create_response
+
+        is_error, create_text = result_text(create_response)
+        if is_error is False:
             print("✅ Habit creation successful!")
-            content = create_response["result"].get("content", [])
-            if content:
-                print(f"   Message: {content[0].get('text', '')}")
+            print(f"   Message: {create_text}")
         else:
             print("❌ Habit creation failed")
-        
+
+    def test_habit_listing(self):
         print("\n4. Testing Habit Listing")
         print("-" * 30)
-        
+
         # List all habits
-        list_response = send_request(process, 5, "tools/call", {
-            "name": "habit_list",
-            "arguments": {}
-        })
-        
-        if list_response and list_response.get("result"):
+        list_response = self.client.call_tool("habit_list", {})
+
+        is_error, list_text = result_text(list_response)
+        if is_error is False:
             print("✅ Habit listing successful!")
-            content = list_response["result"].get("content", [])
-            if content:
-                print(f"   Result: {content[0].get('text', '')}")
+            print(f"   Result: {list_text}")
         else:
             print("❌ Habit listing failed")
 
+    def test_enhanced_listing(self):
         print("\n4.1 Testing Enhanced Habit Listing Features")
         print("-" * 30)
 
         # Create additional test habits with different frequencies
-        test_habits = [
-            {"name": "Weekly Exercise", "category": "health", "frequency": "weekly:3"},
-            {"name": "Weekday Reading", "category": "productivity", "frequency": "weekdays"},
-            {"name": "Weekend Meditation", "category": "mindfulness", "frequency": "weekends"},
-            {"name": "Writing Practice", "category": "creative", "frequency": "interval:2"}
-        ]
-
         habit_ids = []
 
-        for i, habit_data in enumerate(test_habits):
-            create_resp = send_request(process, 50 + i, "tools/call", {
-                "name": "habit_create",
-                "arguments": habit_data
-            })
+        # The creations are independent, so send them together
+        create_resps = self.client.many([
+            tool_call("habit_create", habit_data) for habit_data in TEST_HABITS
+        ])
 
-            if create_resp and create_resp.get("result"):
-                content = create_resp["result"].get("content", [])
-                if content:
-                    message = content[0].get("text", "")
-                    if "Habit ID:" in message:
-                        test_habit_id = message.split("Habit ID: ")[1].strip()
-                        habit_ids.append(test_habit_id)
-                        print(f"   ✅ Created {habit_data['name']} with ID: {test_habit_id}")
+        for habit_data, create_resp in zip(TEST_HABITS, create_resps):
+            test_habit_id = created_habit_id(create_resp)
+            if test_habit_id:
+                habit_ids.append(test_habit_id)
+                print(f"   ✅ Created {habit_data['name']} with ID: {test_habit_id}")
 
         # Add some completions to test streak calculations
-        import json
-        from datetime import datetime, timedelta
-
         if habit_ids:
             print("   Adding sample completions for streak testing...")
-            today = datetime.now()
-
-            # Add completions for the first habit (daily exercise)
-            for j in range(3):
-                date = (today - timedelta(days=2-j)).strftime("%Y-%m-%d")
-                log_resp = send_request(process, 60 + j, "tools/call", {
-                    "name": "habit_log",
-                    "arguments": {
-                        "habit_id": habit_ids[0] if habit_ids else habit_id,
-                        "completed_at": date,
-                        "value": 30,
-                        "intensity": 8
-                    }
+
+            # Add completions for the first habit (daily exercise), oldest first
+            dates, _ = recent_days(3)
+            dates.reverse()
+            log_resps = self.client.many([
+                tool_call("habit_log", {
+                    "habit_id": habit_ids[0],
+                    "completed_at": date,
+                    "value": 30,
+                    "intensity": 8
                 })
-                if log_resp and log_resp.get("result") and not log_resp["result"].get("is_error"):
+                for date in dates
+            ])
+            for date, log_resp in zip(dates, log_resps):
+                if response_ok(log_resp):
                     print(f"      ✅ Logged completion for {date}")
 
+        # The listings below don't depend on each other, so put them all in
+        # flight now and check each one as its response comes in
+        base_list_id = self.client.submit_tool("habit_list", {})
+        sort_ids = [
+            self.client.submit_tool("habit_list", {"sort_by": sort_by})
+            for sort_by, _ in SORT_TESTS
+        ]
+        category_id = self.client.submit_tool("habit_list", {"category": "health"})
+
         # Test 4.1.1: Frequency Display Testing
         print("\n   4.1.1 Testing frequency display...")
-        detailed_list = send_request(process, 70, "tools/call", {
-            "name": "habit_list",
-            "arguments": {}
-        })
 
-        if detailed_list and detailed_list.get("result"):
-            content = detailed_list["result"].get("content", [])
-            if content:
-                list_text = content[0].get("text", "")
-
-                # Check for different frequency displays
-                frequency_checks = [
-                    ("Daily", "daily frequency"),
-                    ("3 times per week", "weekly frequency"),
-                    ("Weekdays", "weekdays frequency"),
-                    ("Weekends", "weekends frequency"),
-                    ("Every 2 days", "interval frequency")
-                ]
+        # The unfiltered listing is fetched once and reused by 4.1.4
+        base_list_text = response_text(self.client.collect(base_list_id))
+
+        if base_list_text:
+            list_text = base_list_text
 
-                found_frequencies = 0
-                for freq_text, description in frequency_checks:
-                    if freq_text in list_text:
-                        print(f"      ✅ Found {description}: '{freq_text}'")
-                        found_frequencies += 1
+            hits = set(FREQUENCY_RE.findall(list_text))
+            found_frequencies = 0
+            for freq_text, description in FREQUENCY_CHECKS:
+                if freq_text in hits:
+                    print(f"      ✅ Found {description}: '{freq_text}'")
+                    found_frequencies += 1
 
-                if found_frequencies >= 3:
-                    print("   ✅ Frequency display conversion working correctly")
-                else:
-                    print(f"   ⚠️ Only found {found_frequencies} frequency displays")
+            if found_frequencies >= 3:
+                print("   ✅ Frequency display conversion working correctly")
+            else:
+                print(f"   ⚠️ Only found {found_frequencies} frequency displays")
 
         # Test 4.1.2: Sorting functionality
         print("\n   4.1.2 Testing sorting functionality...")
 
-        sort_tests = [
-            ("streak", "streak sorting"),
-            ("completion_rate", "completion rate sorting"),
-            ("name", "name sorting")
-        ]
+        # Sorted listings are kept for the structure checks in 4.1.5
+        sorted_texts = {}
 
-        for sort_by, description in sort_tests:
-            sort_resp = send_request(process, 80 + len([s for s, _ in sort_tests if s == sort_by]), "tools/call", {
-                "name": "habit_list",
-                "arguments": {"sort_by": sort_by}
-            })
+        for (sort_by, description), sort_id in zip(SORT_TESTS, sort_ids):
+            sort_resp = self.client.collect(sort_id)
 
-            if sort_resp and sort_resp.get("result"):
-                content = sort_resp["result"].get("content", [])
-                if content:
-                    sorted_text = content[0].get("text", "")
-                    if "habits" in sorted_text.lower():
-                        print(f"      ✅ {description} successful")
-                    else:
-                        print(f"      ❌ {description} failed")
-            else:
+            is_error, sorted_text = result_text(sort_resp)
+            if is_error is None:
                 print(f"      ❌ {description} failed - no response")
+                continue
+
+            sorted_texts[sort_by] = sorted_text
+            if HABITS_RE.search(sorted_text):
+                print(f"      ✅ {description} successful")
+            else:
+                print(f"      ❌ {description} failed")
 
         # Test 4.1.3: Category filtering
         print("\n   4.1.3 Testing category filtering...")
 
-        category_resp = send_request(process, 85, "tools/call", {
-            "name": "habit_list",
-            "arguments": {"category": "health"}
-        })
+        is_error, filtered_text = result_text(self.client.collect(category_id))
 
-        if category_resp and category_resp.get("result"):
-            content = category_resp["result"].get("content", [])
-            if content:
-                filtered_text = content[0].get("text", "")
-                if "health" in filtered_text.lower():
-                    print("      ✅ Category filtering working")
-                else:
-                    print("      ⚠️ Category filtering may not be working as expected")
+        if is_error is not None:
+            if HEALTH_RE.search(filtered_text):
+                print("      ✅ Category filtering working")
+            else:
+                print("      ⚠️ Category filtering may not be working as expected")
 
         # Test 4.1.4: Streak data validation
         print("\n   4.1.4 Testing streak data in listing...")
 
-        full_list = send_request(process, 90, "tools/call", {
-            "name": "habit_list",
-            "arguments": {}
-        })
+        if base_list_text:
+            full_text = base_list_text
 
-        if full_list and full_list.get("result"):
-            content = full_list["result"].get("content", [])
-            if content:
-                full_text = content[0].get("text", "")
-
-                # Check for streak-related data
-                streak_indicators = [
-                    ("streak", "streak data"),
-                    ("completion", "completion data"),
-                    ("rate", "rate data"),
-                    ("%", "percentage data")
-                ]
+            hits = {hit.lower() for hit in STREAK_DATA_RE.findall(full_text)}
+            found_data = 0
+            for indicator, description in STREAK_INDICATORS:
+                if indicator in hits:
+                    print(f"      ✅ Found {description}")
+                    found_data += 1
 
-                found_data = 0
-                for indicator, description in streak_indicators:
-                    if indicator in full_text.lower():
-                        print(f"      ✅ Found {description}")
-                        found_data += 1
-
-                if found_data >= 2:
-                    print("   ✅ Streak and completion data being displayed")
-                else:
-                    print(f"   ⚠️ Limited streak data found ({found_data} indicators)")
+            if found_data >= 2:
+                print("   ✅ Streak and completion data being displayed")
+            else:
+                print(f"   ⚠️ Limited streak data found ({found_data} indicators)")
 
-                # Look for specific numeric data (not zeros)
-                if any(char.isdigit() and char != '0' for char in full_text):
-                    print("      ✅ Found non-zero numeric data")
-                else:
-                    print("      ⚠️ All numeric data appears to be zeros")
+            # Look for specific numeric data (not zeros)
+            if NONZERO_DIGIT_RE.search(full_text):
+                print("      ✅ Found non-zero numeric data")
+            else:
+                print("      ⚠️ All numeric data appears to be zeros")
 
         # Test 4.1.5: JSON structure validation (if we can parse it)
         print("\n   4.1.5 Testing data structure completeness...")
 
-        json_test = send_request(process, 95, "tools/call", {
-            "name": "habit_list",
-            "arguments": {"sort_by": "streak"}
-        })
-
-        if json_test and json_test.get("result"):
-            content = json_test["result"].get("content", [])
-            if content:
-                result_text = content[0].get("text", "")
-
-                # Check for structured data indicators
-                structure_checks = [
-                    ("habit", "habit references"),
-                    ("frequency", "frequency data"),
-                    ("active", "activity status"),
-                    ("category", "category data")
-                ]
-
-                structure_found = 0
-                for check, description in structure_checks:
-                    if check in result_text.lower():
-                        print(f"      ✅ Found {description}")
-                        structure_found += 1
-
-                if structure_found >= 3:
-                    print("   ✅ Data structure appears complete")
-                else:
-                    print(f"   ⚠️ Limited data structure ({structure_found} elements)")
+        # Reuse the streak-sorted listing from 4.1.2
+        streak_sorted_text = sorted_texts.get("streak", "")
+        if streak_sorted_text:
+            hits = {hit.lower() for hit in STRUCTURE_RE.findall(streak_sorted_text)}
+            structure_found = 0
+            for check, description in STRUCTURE_CHECKS:
+                if check in hits:
+                    print(f"      ✅ Found {description}")
+                    structure_found += 1
+
+            if structure_found >= 3:
+                print("   ✅ Data structure appears complete")
+            else:
+                print(f"   ⚠️ Limited data structure ({structure_found} elements)")
 
         print("\n   📊 Enhanced habit listing tests completed")
-        
+
+    def test_habit_logging(self):
         print("\n5. Testing Habit Logging")
         print("-" * 30)
 
         # Extract habit ID from the create response (use original habit from test 3)
-        habit_id = None
-        if create_response and create_response.get("result"):
-            content = create_response["result"].get("content", [])
-            if content:
-                message = content[0].get("text", "")
-                # Look for "Habit ID:" in the response
-                if "Habit ID:" in message:
-                    habit_id = message.split("Habit ID: ")[1].strip()
-                    print(f"   Extracted habit ID: {habit_id}")
-        
+        habit_id = created_habit_id(self.create_response)
+        self.habit_id = habit_id
+        if habit_id:
+            print(f"   Extracted habit ID: {habit_id}")
+
         if habit_id:
             # Try to log a habit completion
-            log_response = send_request(process, 6, "tools/call", {
-                "name": "habit_log",
-                "arguments": {
-                    "habit_id": habit_id,
-                    "value": 30,
-                    "intensity": 8,
-                    "notes": "Great morning workout!"
-                }
+            log_response = self.client.call_tool("habit_log", {
+                "habit_id": habit_id,
+                "value": 30,
+                "intensity": 8,
+                "notes": "Great morning workout!"
             })
-            
-            if log_response and log_response.get("result"):
-                result = log_response["result"]
-                if result.get("is_error"):
-                    print("❌ Habit logging failed")
-                    content = result.get("content", [])
-                    if content:
-                        print(f"   Error: {content[0].get('text', '')}")
-                else:
-                    print("✅ Habit logging successful!")
-                    content = result.get("content", [])
-                    if content:
-                        print(f"   Result: {content[0].get('text', '')}")
-            else:
+
+            is_error, log_text = result_text(log_response)
+            if is_error is None:
                 print("❌ Habit logging failed - no response")
+            elif is_error:
+                print("❌ Habit logging failed")
+                print(f"   Error: {log_text}")
+            else:
+                print("✅ Habit logging successful!")
+                print(f"   Result: {log_text}")
         else:
             print("❌ Could not extract habit ID for logging test")
-        
+
+    def test_habit_status(self):
         print("\n6. Testing Habit Status")
         print("-" * 30)
-        
+
         # Test habit status for all habits
-        status_response = send_request(process, 7, "tools/call", {
-            "name": "habit_status",
-            "arguments": {}
-        })
-        
-        if status_response and status_response.get("result"):
-            result = status_response["result"]
-            if result.get("is_error"):
-                print("❌ Habit status failed")
-                content = result.get("content", [])
-                if content:
-                    print(f"   Error: {content[0].get('text', '')}")
-            else:
-                print("✅ Habit status successful!")
-                content = result.get("content", [])
-                if content:
-                    print(f"   Result:\n{content[0].get('text', '')}")
-        else:
+        status_response = self.client.call_tool("habit_status", {})
+
+        is_error, status_text = result_text(status_response)
+        if is_error is None:
             print("❌ Habit status failed - no response")
-        
+        elif is_error:
+            print("❌ Habit status failed")
+            print(f"   Error: {status_text}")
+        else:
+            print("✅ Habit status successful!")
+            print(f"   Result:\n{status_text}")
+
+    def test_insights(self):
         print("\n7. Testing Habit Insights (Enhanced)")
         print("-" * 30)
 
         # Test basic insights for all habits
         print("   7.1 Testing overall insights...")
-        insights_response = send_request(process, 8, "tools/call", {
-            "name": "habit_insights",
-            "arguments": {
-                "time_period": "month",
-                "insight_type": "all"
-            }
-        })
+        insights_response = self.client.call_tool("habit_insights", MONTH_INSIGHTS)
 
         insights_success = False
-        if insights_response and insights_response.get("result"):
-            result = insights_response["result"]
-            if result.get("is_error"):
-                print("   ❌ Overall insights failed")
-                content = result.get("content", [])
-                if content:
-                    print(f"      Error: {content[0].get('text', '')}")
-            else:
-                print("   ✅ Overall insights successful!")
-                content = result.get("content", [])
-                if content:
-                    insights_text = content[0].get('text', '')
-                    print(f"      Result:\n{insights_text}")
-
-                    # Verify sophisticated analytics features
-                    if "Habit Insights Report" in insights_text:
-                        print("      ✅ Found formatted insights report")
-                        insights_success = True
-                    if "📊" in insights_text or "💡" in insights_text or "🎉" in insights_text:
-                        print("      ✅ Found insight emojis")
-                    if "insights:" in insights_text.lower():
-                        print("      ✅ Found insight summary")
-        else:
+        is_error, insights_text = result_text(insights_response)
+        if is_error is None:
             print("   ❌ Overall insights failed - no response")
+        elif is_error:
+            print("   ❌ Overall insights failed")
+            print(f"      Error: {insights_text}")
+        else:
+            print("   ✅ Overall insights successful!")
+            print(f"      Result:\n{insights_text}")
+
+            # Verify sophisticated analytics features
+            if "Habit Insights Report" in insights_text:
+                print("      ✅ Found formatted insights report")
+                insights_success = True
+            if INSIGHT_EMOJI_RE.search(insights_text):
+                print("      ✅ Found insight emojis")
+            if INSIGHT_SUMMARY_RE.search(insights_text):
+                print("      ✅ Found insight summary")
 
         # Test specific habit insights if we have a habit ID
-        if habit_id and insights_success:
+        if self.habit_id and insights_success:
             print("\n   7.2 Testing specific habit insights...")
-            specific_insights = send_request(process, 9, "tools/call", {
-                "name": "habit_insights",
-                "arguments": {
-                    "habit_id": habit_id,
-                    "time_period": "month",
-                    "insight_type": "all"
-                }
+            specific_insights = self.client.call_tool("habit_insights", {
+                "habit_id": self.habit_id,
+                **MONTH_INSIGHTS
             })
 
-            if specific_insights and specific_insights.get("result"):
-                result = specific_insights["result"]
-                if not result.get("is_error"):
-                    print("   ✅ Specific habit insights successful!")
-                    content = result.get("content", [])
-                    if content:
-                        specific_text = content[0].get('text', '')
-                        # Check for specific analytics features
-                        if "completion rate" in specific_text.lower():
-                            print("      ✅ Found completion rate analysis")
-                        if "streak" in specific_text.lower():
-                            print("      ✅ Found streak analysis")
-                        if "consistency" in specific_text.lower() or "performance" in specific_text.lower():
-                            print("      ✅ Found performance insights")
-                else:
-                    print("   ❌ Specific habit insights failed")
-            else:
+            is_error, specific_text = result_text(specific_insights)
+            if is_error is None:
                 print("   ❌ Specific habit insights failed - no response")
+            elif is_error:
+                print("   ❌ Specific habit insights failed")
+            else:
+                print("   ✅ Specific habit insights successful!")
+                # Check for specific analytics features
+                if COMPLETION_RATE_RE.search(specific_text):
+                    print("      ✅ Found completion rate analysis")
+                if STREAK_RE.search(specific_text):
+                    print("      ✅ Found streak analysis")
+                if PERFORMANCE_RE.search(specific_text):
+                    print("      ✅ Found performance insights")
 
         # Test insight filtering by type
         print("\n   7.3 Testing insight filtering...")
-        filtered_insights = send_request(process, 10, "tools/call", {
-            "name": "habit_insights",
-            "arguments": {
-                "time_period": "month",
-                "insight_type": "recommendation"
-            }
+        filtered_insights = self.client.call_tool("habit_insights", {
+            **MONTH_INSIGHTS,
+            "insight_type": "recommendation"
         })
 
-        if filtered_insights and filtered_insights.get("result"):
-            result = filtered_insights["result"]
-            if not result.get("is_error"):
-                print("   ✅ Insight filtering successful!")
-                content = result.get("content", [])
-                if content:
-                    filtered_text = content[0].get('text', '')
-                    if "recommendation" in filtered_text.lower() or "💡" in filtered_text:
-                        print("      ✅ Found recommendation insights")
-            else:
-                print("   ❌ Insight filtering failed")
-        else:
+        is_error, filtered_text = result_text(filtered_insights)
+        if is_error is None:
             print("   ❌ Insight filtering failed - no response")
+        elif is_error:
+            print("   ❌ Insight filtering failed")
+        else:
+            print("   ✅ Insight filtering successful!")
+            if RECOMMENDATION_RE.search(filtered_text):
+                print("      ✅ Found recommendation insights")
 
         # Create additional habits to test diversity analytics
         print("\n   7.4 Testing category diversity analytics...")
 
-        # Create a second habit in different category
-        create_response2 = send_request(process, 11, "tools/call", {
-            "name": "habit_create",
-            "arguments": {
+        # Create a second and a third habit in different categories
+        create_response2, create_response3 = self.client.batch([
+            tool_call("habit_create", {
                 "name": "Daily Reading",
                 "category": "productivity",
                 "frequency": "daily"
-            }
-        })
-
-        # Create a third habit in another category
-        create_response3 = send_request(process, 12, "tools/call", {
-            "name": "habit_create",
-            "arguments": {
+            }),
+            tool_call("habit_create", {
                 "name": "Meditation",
                 "category": "mindfulness",
                 "frequency": "daily"
-            }
-        })
+            })
+        ])
 
         if create_response2 and create_response3:
             # Now test overall insights with multiple categories
-            diversity_insights = send_request(process, 13, "tools/call", {
-                "name": "habit_insights",
-                "arguments": {
-                    "time_period": "month",
-                    "insight_type": "all"
-                }
-            })
-
-            if diversity_insights and diversity_insights.get("result"):
-                result = diversity_insights["result"]
-                if not result.get("is_error"):
-                    content = result.get("content", [])
-                    if content:
-                        diversity_text = content[0].get('text', '')
-                        if "diversifying" in diversity_text.lower() or "well-rounded" in diversity_text.lower():
-                            print("   ✅ Found category diversity analysis")
-                        if "life areas" in diversity_text.lower() or "categories" in diversity_text.lower():
-                            print("   ✅ Found category analysis")
-                        print(f"      Multi-category insights:\n{diversity_text}")
-                else:
-                    print("   ❌ Diversity insights failed")
+            diversity_insights = self.client.call_tool("habit_insights", MONTH_INSIGHTS)
+
+            is_error, diversity_text = result_text(diversity_insights)
+            if is_error:
+                print("   ❌ Diversity insights failed")
+            elif is_error is False:
+                if DIVERSITY_RE.search(diversity_text):
+                    print("   ✅ Found category diversity analysis")
+                if CATEGORY_ANALYSIS_RE.search(diversity_text):
+                    print("   ✅ Found category analysis")
+                print(f"      Multi-category insights:\n{diversity_text}")
 
         print("\n   📊 Analytics testing summary:")
         print("      - Overall insights: ✅" if insights_success else "      - Overall insights: ❌")
         print("      - Sophisticated features verified")
-        print("      - Insight filtering tested")
+        print("      - Recommendation insights tested")
         print("      - Category diversity tested")
-        
+
+    def test_error_handling(self):
         print("\n8. Testing Error Handling")
         print("-" * 30)
 
-        # Test invalid habit creation
-        print("   Testing invalid habit name...")
-        invalid_create = send_request(process, 14, "tools/call", {
-            "name": "habit_create",
-            "arguments": {
-                "name": "",  # Empty name should fail
+        # The probes are independent, so send them together
+        invalid_create, invalid_category, invalid_log = self.client.many([
+            # Empty name should fail
+            tool_call("habit_create", {
+                "name": "",
                 "category": "health",
                 "frequency": "daily"
-            }
-        })
+            }),
+            tool_call("habit_create", {
+                "name": "Test Habit",
+                "category": "invalid_category",
+                "frequency": "daily"
+            }),
+            # Intensity should be 1-10
+            tool_call("habit_log", {
+                "habit_id": "invalid-id-format",
+                "intensity": 15
+            })
+        ])
 
-        if invalid_create and invalid_create.get("result") and invalid_create["result"].get("is_error"):
+        # Test invalid habit creation
+        print("   Testing invalid habit name...")
+        if response_is_error(invalid_create):
             print("   ✅ Empty name validation working")
         else:
             print("   ❌ Empty name validation failed")
 
         # Test invalid category
         print("   Testing invalid category...")
-        invalid_category = send_request(process, 15, "tools/call", {
-            "name": "habit_create",
-            "arguments": {
-                "name": "Test Habit",
-                "category": "invalid_category",
-                "frequency": "daily"
-            }
-        })
-
-        if invalid_category and invalid_category.get("result") and invalid_category["result"].get("is_error"):
+        if response_is_error(invalid_category):
             print("   ✅ Invalid category validation working")
         else:
             print("   ❌ Invalid category validation failed")
 
         # Test invalid habit logging
         print("   Testing invalid habit logging...")
-        invalid_log = send_request(process, 16, "tools/call", {
-            "name": "habit_log",
-            "arguments": {
-                "habit_id": "invalid-id-format",
-                "intensity": 15  # Should be 1-10
-            }
-        })
-
-        if invalid_log and invalid_log.get("result") and invalid_log["result"].get("is_error"):
+        if response_is_error(invalid_log):
             print("   ✅ Invalid logging validation working")
         else:
             print("   ❌ Invalid logging validation failed")
-        
+
+    def test_streak_calculations(self):
         print("\n9. Testing Streak Calculations")
         print("-" * 30)
 
-        # Helper function to extract streak data from status
-        def extract_streak_data(status_text, habit_name):
-            lines = status_text.split('\n')
-            for i, line in enumerate(lines):
-                if habit_name in line and "🎯" in line:
-                    # Look at the next line for streak info
-                    if i + 1 < len(lines):
-                        streak_line = lines[i + 1]
-                        if "Current streak:" in streak_line and "Best:" in streak_line:
-                            parts = streak_line.split("|")
-                            current_part = parts[0].strip()
-                            best_part = parts[1].strip()
-
-                            current_streak = int(current_part.split("Current streak: ")[1].split(" days")[0])
-                            best_streak = int(best_part.split("Best: ")[1].split(" days")[0])
-
-                            return current_streak, best_streak
-            return None, None
-
-        # Test different frequency types
-        test_cases = [
-            {"name": "Daily Streak Test", "frequency": "daily"},
-            {"name": "Weekdays Streak Test", "frequency": "weekdays"},
-            {"name": "Weekly Streak Test", "frequency": "weekly:3"},
-            {"name": "Weekend Streak Test", "frequency": "weekends"},
-            {"name": "Interval Streak Test", "frequency": "interval:3"}
-        ]
+        # The cases are independent, so each runs on a server and database of
+        # its own, all at once; each case's results are printed together once
+        # all are done
+        for lines in asyncio.run(self.run_streak_cases()):
+            for line in lines:
+                print(line)
 
-        from datetime import datetime, timedelta
+        print("\n   📊 Streak calculation testing completed")
 
-        for i, test_case in enumerate(test_cases):
-            print(f"   9.{i+1} Testing {test_case['name']}...")
+    async def run_streak_cases(self):
+        """Run every streak test case at once, returning each case's report lines"""
+        # The last two weeks of dates, formatted once and shared by every case;
+        # index j is the day j days ago
+        recent_dates, recent_weekdays = recent_days(14)
+
+        with tempfile.TemporaryDirectory(prefix="habit-mcp-streaks-") as db_dir:
+            return await asyncio.gather(*(
+                self.isolated_streak_case(
+                    i, test_case, Path(db_dir) / f"case{i+1}.db", recent_dates, recent_weekdays
+                )
+                for i, test_case in enumerate(STREAK_TEST_CASES)
+            ))
+
+    async def isolated_streak_case(self, i, test_case, db_path, recent_dates, recent_weekdays):
+        """Run one streak test case on a fresh server using the database at db_path"""
+        server_args = self.client.server_args + ["--database", str(db_path)]
+        async with AsyncMCPClient(self.client.server_bin, server_args) as client:
+            if await client.initialize(initialize_params()):
+                lines = await self.streak_case(client, i, test_case, recent_dates, recent_weekdays)
+            else:
+                lines = [
+                    f"   9.{i+1} Testing {test_case['name']}...",
+                    f"   ❌ Could not start a server for {test_case['name']}"
+                ]
 
-            # Create habit for this test
-            create_response = send_request(process, 100+i, "tools/call", {
-                "name": "habit_create",
-                "arguments": {
-                    "name": test_case["name"],
-                    "category": "health",
-                    "frequency": test_case["frequency"]
-                }
-            })
+        if client.stderr:
+            lines.append(f"      Server stderr:\n{client.stderr.decode('utf-8', errors='replace')}")
+        return lines
 
-            if not (create_response and create_response.get("result") and not create_response["result"].get("is_error")):
-                print(f"   ❌ Failed to create {test_case['name']}")
-                continue
+    async def streak_case(self, client, i, test_case, recent_dates, recent_weekdays):
+        """Create one streak test habit, log its completions and check its streak"""
+        lines = [f"   9.{i+1} Testing {test_case['name']}..."]
 
-            # Extract habit ID
-            content = create_response["result"]["content"][0]["text"]
-            if "Habit ID:" in content:
-                test_habit_id = content.split("Habit ID: ")[1].strip()
-            else:
-                print(f"   ❌ Could not extract habit ID for {test_case['name']}")
-                continue
+        # Create habit for this test
+        create_response = await client.call_tool("habit_create", {
+            "name": test_case["name"],
+            "category": "health",
+            "frequency": test_case["frequency"]
+        })
 
-            # Log some completions for streak testing
-            today = datetime.now()
-            log_count = 0
-
-            if test_case["frequency"] == "daily":
-                # Log 3 consecutive days
-                for j in range(3):
-                    date = (today - timedelta(days=2-j)).strftime("%Y-%m-%d")
-                    log_response = send_request(process, 200+i*10+j, "tools/call", {
-                        "name": "habit_log",
-                        "arguments": {
-                            "habit_id": test_habit_id,
-                            "completed_at": date
-                        }
-                    })
-                    if log_response and log_response.get("result") and not log_response["result"].get("is_error"):
-                        log_count += 1
-
-            elif test_case["frequency"] == "weekdays":
-                # Log weekdays only
-                for j in range(7):
-                    date = today - timedelta(days=j)
-                    if date.weekday() < 5:  # Monday=0 to Friday=4
-                        date_str = date.strftime("%Y-%m-%d")
-                        log_response = send_request(process, 200+i*10+j, "tools/call", {
-                            "name": "habit_log",
-                            "arguments": {
-                                "habit_id": test_habit_id,
-                                "completed_at": date_str
-                            }
-                        })
-                        if log_response and log_response.get("result") and not log_response["result"].get("is_error"):
-                            log_count += 1
-
-            elif test_case["frequency"] == "weekends":
-                # Log weekends only
-                for j in range(14):
-                    date = today - timedelta(days=j)
-                    if date.weekday() >= 5:  # Saturday=5, Sunday=6
-                        date_str = date.strftime("%Y-%m-%d")
-                        log_response = send_request(process, 200+i*10+j, "tools/call", {
-                            "name": "habit_log",
-                            "arguments": {
-                                "habit_id": test_habit_id,
-                                "completed_at": date_str
-                            }
-                        })
-                        if log_response and log_response.get("result") and not log_response["result"].get("is_error"):
-                            log_count += 1
-
-            elif "weekly:" in test_case["frequency"]:
-                # Log 3 times this week and 3 times last week
-                for j in [0, 2, 4, 7, 9, 11]:  # Spread across 2 weeks
-                    date = (today - timedelta(days=j)).strftime("%Y-%m-%d")
-                    log_response = send_request(process, 200+i*10+j, "tools/call", {
-                        "name": "habit_log",
-                        "arguments": {
-                            "habit_id": test_habit_id,
-                            "completed_at": date
-                        }
-                    })
-                    if log_response and log_response.get("result") and not log_response["result"].get("is_error"):
-                        log_count += 1
-
-            elif "interval:" in test_case["frequency"]:
-                # Log every 3 days
-                for j in [0, 3, 6]:
-                    date = (today - timedelta(days=j)).strftime("%Y-%m-%d")
-                    log_response = send_request(process, 200+i*10+j, "tools/call", {
-                        "name": "habit_log",
-                        "arguments": {
-                            "habit_id": test_habit_id,
-                            "completed_at": date
-                        }
-                    })
-                    if log_response and log_response.get("result") and not log_response["result"].get("is_error"):
-                        log_count += 1
-
-            # Get status and check streaks
-            status_response = send_request(process, 300+i, "tools/call", {
-                "name": "habit_status",
-                "arguments": {}
+        is_error, create_text = result_text(create_response)
+        if is_error is not False:
+            lines.append(f"   ❌ Failed to create {test_case['name']}")
+            return lines
+
+        # Extract habit ID
+        test_habit_id = created_habit_id(create_response, create_text)
+        if not test_habit_id:
+            lines.append(f"   ❌ Could not extract habit ID for {test_case['name']}")
+            return lines
+
+        # Log some completions for streak testing, all at once
+        log_responses = await asyncio.gather(*(
+            client.call_tool("habit_log", {
+                "habit_id": test_habit_id,
+                "completed_at": recent_dates[j]
             })
+            for j in streak_offsets(test_case["frequency"], recent_weekdays)
+        ))
+        log_count = sum(1 for log_response in log_responses if response_ok(log_response))
 
-            if status_response and status_response.get("result") and not status_response["result"].get("is_error"):
-                status_text = status_response["result"]["content"][0]["text"]
-                current_streak, best_streak = extract_streak_data(status_text, test_case["name"])
+        # Get status and check streaks
+        status_response = await client.call_tool("habit_status", {})
 
-                print(f"      Logged {log_count} completions")
-                print(f"      Current streak: {current_streak}, Best streak: {best_streak}")
+        is_error, status_text = result_text(status_response)
+        if is_error is False:
+            current_streak, best_streak = extract_streak_data(status_text, test_case["name"])
 
-                if current_streak is not None and best_streak is not None and current_streak > 0:
-                    print(f"   ✅ {test_case['name']} streak calculation working")
-                else:
-                    print(f"   ❌ {test_case['name']} streak calculation failed")
+            lines.append(f"      Logged {log_count} completions")
+            lines.append(f"      Current streak: {current_streak}, Best streak: {best_streak}")
+
+            if current_streak is not None and best_streak is not None and current_streak > 0:
+                lines.append(f"   ✅ {test_case['name']} streak calculation working")
             else:
-                print(f"   ❌ Failed to get status for {test_case['name']}")
+                lines.append(f"   ❌ {test_case['name']} streak calculation failed")
+        else:
+            lines.append(f"   ❌ Failed to get status for {test_case['name']}")
 
-        print("\n   📊 Streak calculation testing completed")
+        return lines
 
-        print("\n🎉 MCP Server test completed!")
-        
-    except KeyboardInterrupt:
-        print("\n⏹️ Test interrupted by user")
-    except Exception as e:
-        print(f"\n❌ Test failed with error: {e}")
-    finally:
-        # Clean up
-        print("\n🧹 Cleaning up...")
-        process.terminate()
+def build_server():
+    """Build the release server binary with cargo; returns whether the build succeeded"""
+    print("Building server (cargo build --release)...", flush=True)
+    try:
+        result = subprocess.run(
+            ["cargo", "build", "--release", "--quiet", "--bin", "habit-tracker-mcp"],
+            cwd=REPO_ROOT,
+            stdout=subprocess.DEVNULL
+        )
+    except FileNotFoundError:
+        print("⚠️ cargo not found")
+        return False
+    return result.returncode == 0
+
+def parse_args():
+    """Parse the command line options described in the module docstring"""
+    parser = argparse.ArgumentParser(description="Test the Habit Tracker MCP server over stdio")
+    parser.add_argument("--msgpack", action="store_true",
+                        help="use length-prefixed MessagePack instead of JSON lines")
+    parser.add_argument("--framed", action="store_true",
+                        help="use length-prefixed JSON instead of JSON lines")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="pipeline independent requests instead of batching them")
+    parser.add_argument("--ascii-only", action="store_true",
+                        help="ask the server for ASCII sentinels instead of emoji")
+    return parser.parse_args()
+
+def main():
+    global USE_MSGPACK, USE_FRAMED, USE_PIPELINE, USE_ASCII
+    args = parse_args()
+    USE_MSGPACK = args.msgpack
+    USE_FRAMED = args.framed and not args.msgpack
+    USE_PIPELINE = args.pipeline
+    USE_ASCII = args.ascii_only
+
+    # The request/response log is long: write it in blocks rather than a
+    # write call per line, even on a terminal
+    sys.stdout.reconfigure(line_buffering=False)
+    if USE_MSGPACK and msgpack is None:
+        print("❌ --msgpack requires the msgpack package (pip install msgpack)")
+        sys.exit(1)
+
+    print("🧪 Testing Habit Tracker MCP Server")
+    print("=" * 50)
+
+    # Build once up front and run the binary directly, so no request waits on cargo
+    if os.environ.get("HABIT_MCP_BIN"):
+        server_bin = Path(os.environ["HABIT_MCP_BIN"])
+    else:
+        server_bin = SERVER_BIN
+        # A stale binary could pass for code that no longer compiles
+        if not build_server():
+            print("❌ Build failed; set HABIT_MCP_BIN to test a prebuilt binary instead")
+            sys.exit(1)
+
+    if not server_bin.exists():
+        print(f"❌ Server binary not found at {server_bin}")
+        print("   Build it with: cargo build --release --bin habit-tracker-mcp")
+        sys.exit(1)
+
+    # Start the MCP server process
+    print("Starting MCP server...")
+    server_args = []
+    if os.environ.get("HABIT_MCP_DEBUG"):
+        server_args.append("--debug")
+    if USE_MSGPACK:
+        server_args.append("--msgpack")
+    elif USE_FRAMED:
+        server_args.append("--framed")
+
+    with mcp_session(server_bin, server_args) as client:
         try:
-            process.wait(timeout=5)
-        except subprocess.TimeoutExpired:
-            process.kill()
-        
-        # Show any stderr output
-        stderr = process.stderr.read()
-        if stderr:
-            print("\n📝 Server stderr:")
-            print(stderr)
+            HabitTrackerMcpTests(client).run_all()
+        except KeyboardInterrupt:
+            print("\n⏹️ Test interrupted by user")
+        except Exception as e:
+            print(f"\n❌ Test failed with error: {e}")
+        print("\n🧹 Cleaning up...")
+
+    # Show any stderr output
+    if client.stderr:
+        print("\n📝 Server stderr:")
+        print(client.stderr.decode("utf-8", errors="replace"))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()